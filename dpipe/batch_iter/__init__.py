@@ -5,3 +5,4 @@ See the :doc:`tutorials/batch_iter` tutorial for more details.
 from .pipeline import *
 from .sources import *
 from .utils import *
+from .seeding import *
@@ -1,13 +1,17 @@
+from functools import partial
 from itertools import islice
-from typing import Iterable, Callable, Union
+from threading import Thread
+from typing import Iterable, Callable, Union, Sequence
 
 import numpy as np
 
 from ..itertools import zip_equal
 from ..im.axes import AxesParams
-from .utils import pad_batch_equal
+from .utils import pad_batch_equal, stack_batch
+from .shared import to_shared, from_shared, to_slot, SharedRingBuffer
+from .seeding import _Seeded, seed_objects, apply_seeded, map_payload
 
-__all__ = 'Infinite', 'combine_batches', 'combine_to_arrays', 'combine_pad'
+__all__ = 'Infinite', 'Parallel', 'combine_batches', 'combine_to_arrays', 'combine_pad'
 
 
 def combine_batches(inputs):
@@ -17,25 +21,191 @@ def combine_batches(inputs):
     return tuple(zip_equal(*inputs))
 
 
-def combine_to_arrays(inputs):
+def _broadcast_fields(values, n_fields: int, name: str):
+    if values is None:
+        return [None] * n_fields
+    if len(values) != n_fields:
+        raise ValueError(f'`{name}` must contain a value for each of the {n_fields} fields: {len(values)}.')
+    return values
+
+
+def combine_to_arrays(inputs, dtypes: Sequence = None, shapes: Sequence = None):
     """
     Combines tuples from ``inputs`` into batches of numpy arrays.
+
+    Each batch is allocated once and the entries are written directly into place.
+    ``dtypes`` and ``shapes`` optionally declare the dtype and the shape of a single entry for each field,
+    otherwise they are inferred from the entries.
     """
-    return tuple(map(np.array, combine_batches(inputs)))
+    batches = combine_batches(inputs)
+    dtypes = _broadcast_fields(dtypes, len(batches), 'dtypes')
+    shapes = _broadcast_fields(shapes, len(batches), 'shapes')
+    return tuple(stack_batch(x, dtype, shape) for x, dtype, shape in zip(batches, dtypes, shapes))
 
 
-def combine_pad(inputs, padding_values: AxesParams = 0, ratio: AxesParams = 0.5):
+def combine_pad(inputs, padding_values: AxesParams = 0, ratio: AxesParams = 0.5,
+                dtypes: Sequence = None, shapes: Sequence = None):
     """
     Combines tuples from ``inputs`` into batches and pads each batch in order to obtain
     a correctly shaped numpy array.
 
+    Each batch is allocated once and the entries are written directly into place.
+    ``dtypes`` and ``shapes`` optionally declare the dtype and the padded shape of a single entry for each field,
+    otherwise they are inferred from the entries.
+
     References
     ----------
     `pad_to_shape`
     """
     batches = combine_batches(inputs)
     padding_values = np.broadcast_to(padding_values, [len(batches)])
-    return tuple(pad_batch_equal(x, values, ratio) for x, values in zip(batches, padding_values))
+    dtypes = _broadcast_fields(dtypes, len(batches), 'dtypes')
+    shapes = _broadcast_fields(shapes, len(batches), 'shapes')
+    return tuple(
+        pad_batch_equal(x, values, ratio, dtype, shape)
+        for x, values, dtype, shape in zip(batches, padding_values, dtypes, shapes)
+    )
+
+
+_worker_function = None
+
+
+def _init_worker(func):
+    global _worker_function
+    _worker_function = func
+
+
+def _transfer(value, slot: str = None):
+    if slot is not None:
+        result = to_slot(value, slot)
+        if result is not None:
+            return result
+
+    return to_shared(value)
+
+
+def _apply_worker(value, slot: str = None):
+    value = map_payload(from_shared, value)
+    return map_payload(partial(_transfer, slot=slot), apply_seeded(_worker_function, value))
+
+
+def Parallel(func: Callable, n_workers: int = 1, backend: str = 'thread', buffer_size: int = None,
+             slot_size: int = None, n_slots: int = None):
+    """
+    A pipeline element that applies ``func`` to the incoming objects using ``n_workers`` parallel workers.
+    Can be passed to `Infinite` along with regular transformers.
+
+    Parameters
+    ----------
+    func: Callable
+        the callable that transforms the objects generated by the previous element of the pipeline.
+    n_workers: int
+        the number of parallel workers.
+    backend: str
+        either ``'thread'`` or ``'process'``. Threads are sufficient for functions that release the GIL,
+        e.g. most numpy and scipy routines. Processes are better suited for pure-python functions.
+        With the ``'process'`` backend ``func`` must be picklable (unless the ``fork`` start method is used).
+        The numpy arrays in both the incoming objects and the outputs (including tuples and lists of arrays)
+        are passed through shared memory, the rest is pickled.
+    buffer_size: int, None, optional
+        the number of objects to keep buffered. If None - the ``buffer_size`` of the `Infinite` is used.
+    slot_size: int, None, optional
+        only for the ``'process'`` backend. If not None - the workers write the output arrays straight into
+        a `SharedRingBuffer` of ``n_slots`` preallocated slots of ``slot_size`` bytes, and the next elements
+        of the pipeline receive zero-copy views of these arrays. Outputs that don't fit in a slot,
+        or arrive when all the slots are busy, are transferred through separate shared memory blocks.
+    n_slots: int, None, optional
+        the number of slots. If None - ``2 * n_workers + 2`` slots are allocated.
+
+    Notes
+    -----
+    The objects may be yielded in a different order than they were received, if ``n_workers > 1``.
+
+    A slot is reused only after all the views pointing to it are garbage collected, i.e. when the consumer
+    moves on to the next batch, so the views must be copied if they are needed for longer.
+
+    Examples
+    --------
+    >>> batch_iter = Infinite(
+    >>>     load_by_random_id(dataset.load_image, dataset.load_segm, ids=train_ids),
+    >>>     Parallel(unpack_args(elastic_transform), n_workers=16, backend='process'),
+    >>>     batch_size=10, batches_per_epoch=100,
+    >>> )
+    >>> # assemble the batches in separate processes and pass them without copying
+    >>> batch_iter = Infinite(
+    >>>     load_by_random_id(dataset.load_image, dataset.load_segm, ids=train_ids),
+    >>>     batch_size=10, batches_per_epoch=100,
+    >>>     combiner=Parallel(combine_pad, n_workers=2, backend='process', slot_size=2 ** 28),
+    >>> )
+    """
+    from pdp.interface import ComponentDescription
+    from pdp.base import start_one2one_transformer, StopEvent
+
+    if n_workers <= 0:
+        raise ValueError(f'`n_workers` must be greater than zero, not {n_workers}.')
+    if backend not in ('thread', 'process'):
+        raise ValueError(f'`backend` must be either "thread" or "process", not "{backend}".')
+    if slot_size is not None and backend != 'process':
+        raise ValueError('Shared memory slots are only supported by the "process" backend.')
+
+    def start(q_in, q_out, stop_event):
+        if backend == 'thread':
+            transform = partial(apply_seeded, func)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            from multiprocessing import resource_tracker
+
+            # the shared memory blocks are created by the workers and released by the main process,
+            # so they must be tracked by the same resource tracker
+            resource_tracker.ensure_running()
+            pool = ProcessPoolExecutor(n_workers, initializer=_init_worker, initargs=(func,))
+            ring = None
+            if slot_size is not None:
+                ring = SharedRingBuffer(n_slots or 2 * n_workers + 2, slot_size)
+
+            def submit(value, slot: str = None):
+                value = map_payload(to_shared, value)
+                try:
+                    return pool.submit(_apply_worker, value, slot)
+                except BaseException:
+                    # the inputs never reached the workers, so their blocks are released here
+                    map_payload(from_shared, value)
+                    raise
+
+            def apply(value):
+                # if all the slots are busy, e.g. the consumer holds on to them, fall back to separate blocks
+                index = None if ring is None else ring.acquire(timeout=0)
+                if index is None:
+                    return map_payload(from_shared, submit(value).result())
+
+                try:
+                    value = submit(value, ring.names[index]).result()
+                except BaseException:
+                    ring.release(index)
+                    raise
+
+                return map_payload(lambda x: from_shared(ring.read(index, x)), value)
+
+            def transform(value):
+                try:
+                    return apply(value)
+                except BaseException:
+                    # the pool and the buffer are already closed
+                    if stop_event.is_set():
+                        raise StopEvent from None
+                    raise
+
+            def shutdown():
+                stop_event.wait()
+                pool.shutdown(wait=False)
+                if ring is not None:
+                    ring.close()
+
+            Thread(target=shutdown, daemon=True).start()
+
+        start_one2one_transformer(transform, q_in=q_in, q_out=q_out, stop_event=stop_event, n_workers=n_workers)
+
+    return ComponentDescription(start, n_workers, buffer_size)
 
 
 class Infinite:
@@ -48,6 +218,7 @@ class Infinite:
         an infinite iterable.
     transformers: Callable
         the callable that transforms the objects generated by the previous element of the pipeline.
+        Use `Parallel` to apply a transformer with several workers.
     batch_size: int, Callable
         the size of batch.
     batches_per_epoch: int
@@ -56,7 +227,13 @@ class Infinite:
         the number of objects to keep buffered in each pipeline element. Default is 3.
     combiner: Callable
         combines chunks of single batches in multiple batches, e.g. combiner([(x, y), (x, y)]) -> ([x, x], [y, y]).
-        Default is `combine_to_arrays`.
+        Default is `combine_to_arrays`. Use `Parallel` to combine the batches in several workers.
+    random_state: int, SeedSequence, None, optional
+        if not None - each object yielded by ``source`` gets an independent random stream derived from
+        ``random_state``, which is available to the transformers via `get_random_state`. The batches are
+        assembled in the order the objects were yielded by ``source``, so the pipeline is reproducible
+        regardless of the number of workers, as long as ``source`` itself is.
+        Only callables and `Parallel` elements are supported as transformers in this case.
 
     References
     ----------
@@ -65,26 +242,36 @@ class Infinite:
 
     def __init__(self, source: Iterable, *transformers: Callable,
                  batch_size: Union[int, Callable], batches_per_epoch: int,
-                 buffer_size: int = 3, combiner: Callable = combine_to_arrays):
+                 buffer_size: int = 3, combiner: Callable = combine_to_arrays,
+                 random_state: Union[np.random.SeedSequence, int] = None):
         import pdp
         from pdp.interface import ComponentDescription
 
         if batches_per_epoch <= 0:
             raise ValueError(f'Expected a positive amount of batches per epoch, but got {batches_per_epoch}')
+        seeded = random_state is not None
+        if seeded and isinstance(source, ComponentDescription):
+            raise TypeError('`random_state` is not supported for sources, that are pipeline elements.')
 
-        def wrap(o):
+        def wrap(o, seeded=False):
             if not isinstance(o, ComponentDescription):
+                if seeded:
+                    o = partial(apply_seeded, o)
                 o = pdp.One2One(o, buffer_size=buffer_size)
+            elif o.buffer_size is None:
+                o = o._replace(buffer_size=buffer_size)
             return o
 
         if not isinstance(source, ComponentDescription):
+            if seeded:
+                source = seed_objects(source, random_state)
             source = pdp.Source(source, buffer_size=buffer_size)
 
         self.batches_per_epoch = batches_per_epoch
         self.pipeline = pdp.Pipeline(
-            source, *map(wrap, transformers),
+            source, *(wrap(transformer, seeded) for transformer in transformers),
             self._make_combiner(batch_size),
-            pdp.One2One(combiner, buffer_size=buffer_size)
+            wrap(combiner),
         )
 
     @staticmethod
@@ -107,8 +294,10 @@ class Infinite:
 
         def start_combiner(q_in, q_out, stop_event):
             chunk = []
+            # the seeded objects can arrive out of order from parallel workers
+            pending, next_index = {}, 0
 
-            def process_data(item):
+            def add(item):
                 nonlocal chunk
                 if not chunk or should_add(chunk, item):
                     chunk.append(item)
@@ -116,6 +305,16 @@ class Infinite:
                     q_out.put(chunk)
                     chunk = [item]
 
+            def process_data(item):
+                nonlocal next_index
+                if not isinstance(item, _Seeded):
+                    return add(item)
+
+                pending[item.index] = item.value
+                while next_index in pending:
+                    add(pending.pop(next_index))
+                    next_index += 1
+
             start_transformer(process_data, q_in, q_out, stop_event=stop_event, n_workers=1)
 
         return ComponentDescription(start_combiner, 1, 1)
@@ -137,4 +336,6 @@ class Infinite:
         return self.pipeline.__exit__(exc_type, exc_val, exc_tb)
 
     def __del__(self):
-        self.close()
+        # the constructor might have failed before the pipeline was created
+        if hasattr(self, 'pipeline'):
+            self.close()
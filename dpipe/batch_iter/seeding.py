@@ -0,0 +1,93 @@
+"""
+Tools for reproducible random transformations in parallel pipelines.
+
+If `Infinite` receives a ``random_state``, each object yielded by the source gets its own random stream,
+derived from ``random_state`` via `numpy.random.SeedSequence.spawn`. The stream travels along with the object
+through the pipeline, so the results don't depend on which worker processed the object.
+"""
+import threading
+from contextlib import contextmanager
+from typing import NamedTuple, Iterable, Callable, Union
+
+import numpy as np
+
+__all__ = 'get_random_state',
+
+# the random state used by `np.random.normal`, `np.random.binomial` etc.
+_global_random_state = np.random.mtrand._rand
+_local = threading.local()
+
+
+class _Seeded(NamedTuple):
+    """An object that carries its own random stream through the pipeline."""
+    index: int
+    seed: np.random.SeedSequence
+    value: object
+
+
+def to_random_state(random_state: Union[np.random.RandomState, np.random.SeedSequence, int, None]):
+    """Convert an int, a `numpy.random.SeedSequence` or None to a `numpy.random.RandomState`."""
+    if isinstance(random_state, np.random.RandomState):
+        return random_state
+    if isinstance(random_state, np.random.SeedSequence):
+        return np.random.RandomState(np.random.PCG64(random_state))
+    return np.random.RandomState(random_state)
+
+
+def get_random_state() -> np.random.RandomState:
+    """
+    Returns the random state of the object that is currently being processed by the pipeline.
+    Outside a pipeline with a ``random_state``, the global numpy random state is returned.
+
+    Examples
+    --------
+    >>> def random_flip(x):
+    >>>     if get_random_state().binomial(1, 0.5):
+    >>>         return np.flip(x, -1)
+    >>>     return x
+    """
+    seed = getattr(_local, 'seed', None)
+    if seed is None:
+        return _global_random_state
+    if _local.random_state is None:
+        _local.random_state = to_random_state(seed)
+    return _local.random_state
+
+
+@contextmanager
+def _use_seed(seed: np.random.SeedSequence):
+    previous = getattr(_local, 'seed', None), getattr(_local, 'random_state', None)
+    _local.seed, _local.random_state = seed, None
+    try:
+        yield
+    finally:
+        _local.seed, _local.random_state = previous
+
+
+def seed_objects(iterable: Iterable, random_state: Union[np.random.SeedSequence, int]):
+    """Attach an independent random stream to each object from ``iterable``."""
+    if not isinstance(random_state, np.random.SeedSequence):
+        random_state = np.random.SeedSequence(random_state)
+
+    for index, value in enumerate(iterable):
+        yield _Seeded(index, random_state.spawn(1)[0], value)
+
+
+def apply_seeded(func: Callable, value):
+    """
+    Apply ``func`` to ``value``. If ``value`` carries a random stream - it is used by `get_random_state`
+    during the call, and the result carries the rest of the stream.
+    """
+    if not isinstance(value, _Seeded):
+        return func(value)
+
+    current, following = value.seed.spawn(2)
+    with _use_seed(current):
+        return value._replace(seed=following, value=func(value.value))
+
+
+def map_payload(func: Callable, value):
+    """Apply ``func`` to the object carried by ``value``, keeping the random stream unchanged."""
+    if not isinstance(value, _Seeded):
+        return func(value)
+    return value._replace(value=func(value.value))
@@ -0,0 +1,212 @@
+"""
+Tools for passing numpy arrays between processes through shared memory instead of pickling.
+"""
+import weakref
+from queue import Queue, Empty
+from typing import NamedTuple, Tuple, Optional
+
+import numpy as np
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:  # python < 3.8
+    SharedMemory = object
+
+__all__ = 'SharedRingBuffer',
+
+
+class SharedArray(NamedTuple):
+    """A picklable description of an array located in a shared memory block."""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: np.dtype
+
+
+def _is_shareable(value) -> bool:
+    return isinstance(value, np.ndarray) and not value.dtype.hasobject
+
+
+def to_shared(value):
+    """
+    Recursively move all the numpy arrays contained in ``value`` (which can be a tuple or a list of arrays)
+    to newly created shared memory blocks. The other objects are left unchanged.
+
+    The blocks must be released by the receiving process via `from_shared`.
+    """
+    if type(value) in (tuple, list):
+        return type(value)(map(to_shared, value))
+    if not _is_shareable(value):
+        return value
+
+    memory = SharedMemory(create=True, size=max(value.nbytes, 1))
+    try:
+        np.ndarray(value.shape, value.dtype, buffer=memory.buf)[...] = value
+    finally:
+        memory.close()
+
+    return SharedArray(memory.name, value.shape, value.dtype)
+
+
+def from_shared(value):
+    """
+    Recursively restore the numpy arrays contained in ``value`` and release the corresponding shared memory blocks.
+    The inverse of `to_shared`.
+    """
+    if isinstance(value, SharedArray):
+        memory = SharedMemory(value.name)
+        try:
+            return np.ndarray(value.shape, value.dtype, buffer=memory.buf).copy()
+        finally:
+            memory.close()
+            memory.unlink()
+
+    if type(value) in (tuple, list):
+        return type(value)(map(from_shared, value))
+    return value
+
+
+class _Slot(SharedMemory):
+    """A shared memory block which may outlive the buffer, if there are views pointing to it."""
+
+    def __del__(self):
+        try:
+            super().__del__()
+        except BufferError:
+            pass
+
+
+class SlotArray(NamedTuple):
+    """A picklable description of an array located in a slot of a `SharedRingBuffer`."""
+    offset: int
+    shape: Tuple[int, ...]
+    dtype: np.dtype
+
+
+# the slots attached by the current process
+_attached_slots = {}
+
+
+def _align(size: int, alignment: int = 64) -> int:
+    return -(-size // alignment) * alignment
+
+
+def _leaves(value):
+    if type(value) in (tuple, list):
+        for x in value:
+            yield from _leaves(x)
+    else:
+        yield value
+
+
+def to_slot(value, name: str):
+    """
+    Recursively write all the numpy arrays contained in ``value`` into the slot ``name`` of a `SharedRingBuffer`.
+    Returns the ``value`` with all the arrays replaced by their descriptions,
+    or None if the arrays don't fit in the slot.
+    """
+    if name not in _attached_slots:
+        _attached_slots[name] = SharedMemory(name)
+    memory = _attached_slots[name]
+
+    if sum(_align(x.nbytes) for x in _leaves(value) if _is_shareable(x)) > memory.size:
+        return None
+
+    offset = 0
+
+    def write(x):
+        nonlocal offset
+        if type(x) in (tuple, list):
+            return type(x)(map(write, x))
+        if not _is_shareable(x):
+            return x
+
+        np.ndarray(x.shape, x.dtype, buffer=memory.buf, offset=offset)[...] = x
+        result = SlotArray(offset, x.shape, x.dtype)
+        offset += _align(x.nbytes)
+        return result
+
+    return write(value)
+
+
+class SharedRingBuffer:
+    """
+    A pool of ``n_slots`` preallocated shared memory blocks of ``slot_size`` bytes each.
+
+    A producer process writes its arrays straight into a free slot via `to_slot`, and the consumer gets
+    zero-copy views of these arrays via `read`. A slot is reused only after all the arrays read from it
+    are garbage collected, i.e. once the consumer advances past them. Keep a copy of an array
+    if it must outlive the consumer's iteration.
+
+    Parameters
+    ----------
+    n_slots: int
+    slot_size: int
+        the size of each slot in bytes.
+    """
+
+    def __init__(self, n_slots: int, slot_size: int):
+        if n_slots <= 0 or slot_size <= 0:
+            raise ValueError(f'Both `n_slots` and `slot_size` must be positive: {n_slots}, {slot_size}.')
+
+        self._blocks = [_Slot(create=True, size=slot_size) for _ in range(n_slots)]
+        self._closed = False
+        self._free = Queue()
+        for index in range(n_slots):
+            self._free.put(index)
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        """The names of the slots' shared memory blocks."""
+        return tuple(block.name for block in self._blocks)
+
+    def acquire(self, timeout: float = None) -> Optional[int]:
+        """Wait for a free slot and return its index. Returns None if no slot was freed during ``timeout`` seconds."""
+        try:
+            return self._free.get(timeout != 0, timeout or None)
+        except Empty:
+            return None
+
+    def release(self, index: int):
+        """Mark the slot ``index`` as free."""
+        self._free.put(index)
+
+    def read(self, index: int, value):
+        """
+        Restore the arrays written by `to_slot` into the slot ``index`` as zero-copy views.
+        The slot is released as soon as these views are garbage collected.
+        """
+        if self._closed:
+            raise ValueError('The buffer is already closed.')
+        if not any(isinstance(x, SlotArray) for x in _leaves(value)):
+            self.release(index)
+            return value
+
+        memory = np.frombuffer(self._blocks[index].buf, np.uint8)
+        weakref.finalize(memory, self.release, index)
+
+        def restore(x):
+            if isinstance(x, SlotArray):
+                dtype = np.dtype(x.dtype)
+                size = dtype.itemsize * int(np.prod(x.shape))
+                return memory[x.offset:x.offset + size].view(dtype).reshape(x.shape)
+            if type(x) in (tuple, list):
+                return type(x)(map(restore, x))
+            return x
+
+        return restore(value)
+
+    def close(self):
+        """Free the shared memory. The existing views remain valid."""
+        if self._closed:
+            return
+
+        self._closed = True
+        for block in self._blocks:
+            # the block stays mapped while there are views pointing to it,
+            # and will be closed once the buffer is garbage collected
+            try:
+                block.close()
+            except BufferError:
+                pass
+            block.unlink()
+
@@ -3,11 +3,121 @@ from typing import Sequence, Callable, Union
 import numpy as np
 
 from dpipe.itertools import pam, squeeze_first
+from .seeding import to_random_state
 
-__all__ = 'sample', 'load_by_random_id'
+__all__ = 'sample', 'load_by_random_id', 'WeightedSampler'
 
 
-def sample(sequence: Sequence, weights: Sequence[float] = None, random_state: Union[np.random.RandomState, int] = None):
+class WeightedSampler:
+    """
+    Infinitely yields indices in ``[0, len(weights))`` with probabilities proportional to ``weights``.
+
+    Uses Walker's alias method: the table is built once in O(N), after which the indices are drawn
+    in blocks of ``block_size`` in O(1) per index.
+
+    Parameters
+    ----------
+    weights: Sequence[float]
+        the non-negative weights associated with each index.
+    random_state
+        if not None - used to set the random seed for reproducibility reasons.
+    block_size: int
+        the number of indices drawn at once.
+
+    Examples
+    --------
+    >>> sampler = WeightedSampler(np.ones(len(ids)))
+    >>> batch_iter = Infinite(sample(ids, sampler), ...)
+    >>> # hard-example mining: increase the weights of the ids with the highest loss
+    >>> sampler.update(hard_indices, 10)
+    """
+
+    def __init__(self, weights: Sequence[float],
+                 random_state: Union[np.random.RandomState, np.random.SeedSequence, int] = None,
+                 block_size: int = 1024):
+        weights = np.array(weights, dtype=float)
+        assert weights.ndim == 1 and weights.size, weights.shape
+        assert block_size > 0, block_size
+
+        self.block_size = block_size
+        self.random_state = to_random_state(random_state)
+        self._weights = weights
+        self._version = 0
+        # the alias table together with the version of the weights it was built from
+        self._table = None, None
+        self._check_weights()
+
+    def __len__(self):
+        return len(self._weights)
+
+    @property
+    def weights(self) -> np.ndarray:
+        """A read-only view of the current weights."""
+        weights = self._weights.view()
+        weights.flags.writeable = False
+        return weights
+
+    def _check_weights(self):
+        assert (self._weights >= 0).all() and (self._weights > 0).any(), self._weights
+
+    def update(self, indices, weights):
+        """
+        Set the weights at ``indices`` to ``weights``.
+        The alias table is rebuilt only once before the next draw, so several consecutive updates are cheap.
+        """
+        self._weights[indices] = weights
+        self._check_weights()
+        self._version += 1
+
+    def _build_table(self):
+        n = len(self._weights)
+        # scale so that the mean probability equals 1
+        prob = self._weights * (n / self._weights.sum())
+        alias = np.arange(n)
+
+        small, = np.nonzero(prob < 1)
+        large, = np.nonzero(prob >= 1)
+        # each round pairs every available large index with at most one small index, so the rounds are vectorized
+        while small.size and large.size:
+            k = min(small.size, large.size)
+            s, l = small[:k], large[:k]
+            alias[s] = l
+            prob[l] -= 1 - prob[s]
+
+            still_large = prob[l] >= 1
+            small = np.concatenate([small[k:], l[~still_large]])
+            large = np.concatenate([large[k:], l[still_large]])
+
+        # only the rounding errors are left
+        prob[small] = prob[large] = 1
+        return prob, alias
+
+    def draw(self, size: int) -> np.ndarray:
+        """Draw ``size`` indices at once."""
+        # `update` may be called from another thread, so the table and its version are read and stored together.
+        # The version is read before building, so a concurrent update only triggers one more rebuild
+        version, table = self._table
+        if version != self._version:
+            version = self._version
+            table = self._build_table()
+            self._table = version, table
+        prob, alias = table
+
+        indices = self.random_state.randint(len(prob), size=size)
+        return np.where(self.random_state.random_sample(size) < prob[indices], indices, alias[indices])
+
+    def __iter__(self):
+        while True:
+            version = self._version
+            for index in self.draw(self.block_size):
+                yield index
+                # the rest of the block is stale
+                if self._version != version:
+                    break
+
+
+def sample(sequence: Sequence, weights: Union[Sequence[float], WeightedSampler] = None,
+           random_state: Union[np.random.RandomState, np.random.SeedSequence, int] = None):
     """
     Infinitely yield samples from ``sequence`` according to ``weights``.
 
@@ -15,27 +125,35 @@ def sample(sequence: Sequence, weights: Sequence[float] = None, random_state: Un
     ----------
     sequence: Sequence
         the sequence of elements to sample from.
-    weights: Sequence[float], None, optional
+    weights: Sequence[float], WeightedSampler, None, optional
         the weights associated with each element. If ``None``, the weights are assumed to be equal.
-        Should be the same size as ``sequence``.
+        Should be the same size as ``sequence``. If a `WeightedSampler` is passed, its weights can be updated
+        while sampling.
     random_state
         if not None - used to set the random seed for reproducibility reasons.
+        Must be None if ``weights`` is a `WeightedSampler`.
     """
-    if weights is not None:
-        weights = np.asarray(weights)
-        assert (weights >= 0).all() and (weights > 0).any(), weights
-        weights = weights / weights.sum()
+    if weights is None:
+        indices = _sample_uniformly(len(sequence), to_random_state(random_state))
+    else:
+        if isinstance(weights, WeightedSampler):
+            assert random_state is None, 'The random state must be passed to the sampler itself.'
+            indices = weights
+        else:
+            indices = WeightedSampler(weights, random_state)
+        assert len(indices) == len(sequence), (len(indices), len(sequence))
+
+    for index in indices:
+        yield sequence[index]
 
-    if not isinstance(random_state, np.random.RandomState):
-        random_state = np.random.RandomState(random_state)
 
+def _sample_uniformly(n: int, random_state: np.random.RandomState, block_size: int = 1024):
     while True:
-        index = random_state.choice(len(sequence), p=weights)
-        yield sequence[index]
+        yield from random_state.randint(n, size=block_size)
 
 
-def load_by_random_id(*loaders: Callable, ids: Sequence, weights: Sequence[float] = None,
-                      random_state: Union[np.random.RandomState, int] = None):
+def load_by_random_id(*loaders: Callable, ids: Sequence, weights: Union[Sequence[float], WeightedSampler] = None,
+                      random_state: Union[np.random.RandomState, np.random.SeedSequence, int] = None):
     """
     Infinitely yield objects loaded by ``loaders`` according to the identifier from ``ids``.
     The identifiers are randomly sampled from ``ids`` according to the ``weights``.
@@ -46,7 +164,7 @@ def load_by_random_id(*loaders: Callable, ids: Sequence, weights: Sequence[float
         function, which loads object by its id.
     ids: Sequence
         the sequence of identifiers to sample from.
-    weights: Sequence[float], None, optional
+    weights: Sequence[float], WeightedSampler, None, optional
         The weights associated with each id. If ``None``, the weights are assumed to be equal.
         Should be the same size as ``ids``.
     random_state
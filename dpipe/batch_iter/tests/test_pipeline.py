@@ -1,8 +1,10 @@
 from itertools import repeat
 
+import numpy as np
 import pytest
 
-from dpipe.batch_iter import Infinite, combine_to_arrays
+from dpipe.batch_iter import Infinite, Parallel, combine_to_arrays, combine_pad, sample, random_apply, sample_args
+from dpipe.im import pad_to_shape
 
 
 def pipeline(source, iters=1, transformers=(), batch_size=1, combiner=combine_to_arrays):
@@ -61,3 +63,94 @@ def test_del():
     p = pipeline(repeat([1]), 1)
     assert len(list(p())) == 1
     del p
+
+
+def double(x):
+    return x * 2, x.shape
+
+
+def test_parallel():
+    x = np.random.randn(2, 3)
+    for backend in ['thread', 'process']:
+        with pipeline(repeat(x), 3, [Parallel(double, 2, backend)], batch_size=4) as p:
+            for xs, shapes in p():
+                np.testing.assert_array_equal(xs, [x * 2] * 4)
+                np.testing.assert_array_equal(shapes, [x.shape] * 4)
+
+    with pipeline(repeat(x), 10, [Parallel(double, 2, 'process', slot_size=1024, n_slots=3)], batch_size=4) as p:
+        for xs, shapes in p():
+            np.testing.assert_array_equal(xs, [x * 2] * 4)
+
+    with pytest.raises(ValueError):
+        Parallel(double, 0)
+    with pytest.raises(ValueError):
+        Parallel(double, 2, 'thread', slot_size=1024)
+    with pytest.raises(ValueError):
+        Parallel(double, 2, 'gpu')
+
+
+def test_parallel_combiner():
+    x = np.random.randn(2, 3)
+    combiner = Parallel(combine_to_arrays, 2, 'process', slot_size=1024)
+    with pipeline(repeat((x, 1)), 10, batch_size=3, combiner=combiner) as p:
+        for xs, ys in p():
+            np.testing.assert_array_equal(xs, [x] * 3)
+            np.testing.assert_array_equal(ys, [1] * 3)
+
+
+def test_combine_to_arrays():
+    inputs = [(np.full((2, 3), i), i, float(i)) for i in range(4)]
+    xs, ys, zs = combine_to_arrays(inputs)
+    np.testing.assert_array_equal(xs, np.array([x for x, _, _ in inputs]))
+    np.testing.assert_array_equal(ys, np.arange(4))
+    assert zs.dtype == float
+
+    xs, ys, zs = combine_to_arrays(inputs, dtypes=[np.float32, None, np.int8], shapes=[(2, 3), None, ()])
+    assert xs.dtype == np.float32 and zs.dtype == np.int8
+
+    with pytest.raises(ValueError):
+        combine_to_arrays([(np.zeros(2),), (np.zeros(3),)])
+    with pytest.raises(ValueError):
+        combine_to_arrays(inputs, dtypes=[float])
+
+
+def test_combine_pad():
+    inputs = [(np.random.randn(3, np.random.randint(1, 10)), i) for i in range(10)]
+    for ratio in [0, .3, .5, 1]:
+        xs, ys = combine_pad(inputs, padding_values=-1, ratio=ratio)
+        shape = 3, max(x.shape[1] for x, _ in inputs)
+        np.testing.assert_array_equal(xs, [pad_to_shape(x, shape, padding_values=-1, ratio=ratio)
+                                           for x, _ in inputs])
+        np.testing.assert_array_equal(ys, np.arange(10))
+
+    xs, ys = combine_pad(inputs, padding_values=np.min, shapes=[(4, 12), None], dtypes=[np.float32, None])
+    assert xs.shape == (10, 4, 12) and xs.dtype == np.float32
+    np.testing.assert_allclose(xs, [pad_to_shape(x, (4, 12), padding_values=np.min) for x, _ in inputs])
+
+    with pytest.raises(ValueError):
+        combine_pad(inputs, shapes=[(3, 2), None])
+
+
+def noise(x):
+    return x + np.random.normal()
+
+
+random_noise = random_apply(0.5, sample_args(np.add, np.random.normal))
+
+
+def test_random_state():
+    def run(*transformers, random_state=0):
+        with Infinite(sample(range(100), random_state=1), *transformers, batch_size=4, batches_per_epoch=10,
+                      random_state=random_state) as p:
+            return np.concatenate([xs for xs, in p()])
+
+    expected = run(lambda x: (x,), random_noise, random_noise)
+    assert not np.isin(expected, np.arange(100)).all()
+    for backend in ['thread', 'process']:
+        np.testing.assert_array_equal(
+            run(lambda x: (x,), Parallel(random_noise, 4, backend), Parallel(random_noise, 3, backend)), expected
+        )
+
+    assert not np.array_equal(run(lambda x: (x,), random_noise, random_noise, random_state=1), expected)
+    with pytest.raises(TypeError):
+        Infinite(Parallel(noise), batch_size=1, batches_per_epoch=1, random_state=0)
@@ -0,0 +1,43 @@
+import gc
+
+import numpy as np
+
+from dpipe.batch_iter.shared import SharedRingBuffer, to_slot, to_shared, from_shared
+
+
+def test_to_from_shared():
+    value = (np.random.randn(3, 4), [np.arange(5), 'label'], 1)
+    restored = from_shared(to_shared(value))
+    np.testing.assert_array_equal(restored[0], value[0])
+    np.testing.assert_array_equal(restored[1][0], value[1][0])
+    assert restored[1][1:] == ['label'] and restored[2] == 1
+
+
+def test_ring_buffer():
+    ring = SharedRingBuffer(2, 1024)
+    try:
+        first, second = ring.acquire(), ring.acquire()
+        assert ring.acquire(timeout=.01) is None
+
+        x, y = np.random.randn(4, 5), np.arange(10, dtype='int16')
+        xs, (ys, label) = ring.read(first, to_slot((x, (y, 'label')), ring.names[first]))
+        np.testing.assert_array_equal(xs, x)
+        np.testing.assert_array_equal(ys, y)
+        assert label == 'label'
+        assert not xs.flags.owndata
+
+        # doesn't fit
+        assert to_slot(np.zeros(1000), ring.names[second]) is None
+        assert ring.read(second, 'no arrays') == 'no arrays'
+        assert ring.acquire(timeout=.01) == second
+
+        # the slot is released only after all the views are collected
+        view = xs[1:]
+        del xs, ys
+        gc.collect()
+        assert ring.acquire(timeout=.01) is None
+        del view
+        gc.collect()
+        assert ring.acquire(timeout=.01) == first
+    finally:
+        ring.close()
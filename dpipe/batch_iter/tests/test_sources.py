@@ -2,7 +2,7 @@ from itertools import islice
 
 import numpy as np
 
-from dpipe.batch_iter import sample
+from dpipe.batch_iter import sample, WeightedSampler
 
 almost_eq = np.testing.assert_almost_equal
 
@@ -20,3 +20,31 @@ def test_sample():
 
     almost_eq(get_sum(), 0.5, decimal=2)
     almost_eq(get_sum([1, 4]), 0.8, decimal=2)
+
+
+def test_weighted_sampler():
+    weights = np.random.RandomState(0).uniform(size=50) ** 3
+    weights[[3, 17]] = 0
+    sampler = WeightedSampler(weights, random_state=0)
+    counts = np.bincount(sampler.draw(10 ** 6), minlength=len(weights))
+
+    assert counts[[3, 17]].sum() == 0
+    almost_eq(counts / counts.sum(), weights / weights.sum(), decimal=3)
+
+
+def test_weighted_sampler_update():
+    sampler = WeightedSampler([1, 1, 1], random_state=0, block_size=100)
+    stream = sample('abc', sampler)
+    assert set(islice(stream, 1000)) == set('abc')
+
+    sampler.update([0, 1], 0)
+    assert set(islice(stream, 1000)) == {'c'}
+
+    sampler.update(slice(None), [1, 0, 0])
+    assert set(islice(stream, 1000)) == {'a'}
+
+
+def test_sample_reproducible():
+    for weights in [None, [1, 2, 3, 4]]:
+        first, second = [list(islice(sample(range(4), weights, random_state=42), 100)) for _ in range(2)]
+        assert first == second
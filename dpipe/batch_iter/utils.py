@@ -1,25 +1,100 @@
-from typing import Callable, Iterable, Sequence
+from functools import reduce
+from typing import Callable, Iterable, Sequence, Union
 
 import numpy as np
 
 from dpipe.im.axes import AxesLike, AxesParams
+from dpipe.im.utils import build_slices
 from dpipe.itertools import lmap, squeeze_first
 from dpipe.im import pad_to_shape
+from .seeding import get_random_state, _global_random_state
 
+__all__ = (
+    'stack_batch', 'pad_batch_equal', 'unpack_args', 'multiply', 'apply_at', 'zip_apply', 'random_apply',
+    'sample_args', 'pad_to_shape',
+)
 
-def pad_batch_equal(batch, padding_values: AxesParams = 0, ratio: AxesParams = 0.5):
+
+def _get_batch_dtype(batch: Sequence[np.ndarray], dtype):
+    if dtype is not None:
+        return np.dtype(dtype)
+    return reduce(np.promote_types, {x.dtype for x in batch})
+
+
+def stack_batch(batch: Sequence, dtype=None, shape: AxesLike = None) -> np.ndarray:
+    """
+    Stack the elements of ``batch`` into a single array, which is allocated only once.
+
+    Parameters
+    ----------
+    batch
+    dtype
+        the dtype of the resulting array. If None - the common dtype of all the elements is used.
+    shape
+        the shape of a single element. If None - the shape of the first element is used.
+    """
+    batch = lmap(np.asarray, batch)
+    if not batch:
+        return np.array(batch, dtype)
+
+    shape = batch[0].shape if shape is None else tuple(np.atleast_1d(shape))
+    result = np.empty((len(batch), *shape), _get_batch_dtype(batch, dtype))
+    for idx, x in enumerate(batch):
+        if x.shape != shape:
+            raise ValueError(f'All the elements must have the same shape: {x.shape} vs {shape}.')
+        result[idx] = x
+
+    return result
+
+
+def pad_batch_equal(batch, padding_values: Union[AxesParams, Callable] = 0, ratio: AxesParams = 0.5,
+                    dtype=None, shape: AxesLike = None) -> np.ndarray:
     """
     Pad each element of ``batch`` to obtain a correctly shaped array.
 
+    The resulting array is allocated only once, and each element is written directly into place.
+
+    Parameters
+    ----------
+    batch
+    padding_values
+        values to pad with. If Callable (e.g. `numpy.min`) - ``padding_values(x)`` will be used for each element.
+    ratio
+        the fraction of the padding that will be applied to the left, ``1 - ratio`` will be applied to the right.
+    dtype
+        the dtype of the resulting array. If None - the common dtype of all the elements is used.
+    shape
+        the shape of a single padded element. If None - the maximal shape along each axis is used.
+
     References
     ----------
     `pad_to_shape`
     """
-    max_shapes = np.max(lmap(np.shape, batch), axis=0)
-    # if not scalars
-    if max_shapes.size != 0:
-        batch = [pad_to_shape(x, max_shapes, padding_values=padding_values, ratio=ratio) for x in batch]
-    return np.array(batch)
+    batch = lmap(np.asarray, batch)
+    if shape is None:
+        shape = np.max(lmap(np.shape, batch), axis=0)
+    shape = np.atleast_1d(shape).astype(int)
+    # if scalars
+    if not batch or shape.size == 0:
+        return stack_batch(batch, dtype)
+
+    ratio = np.broadcast_to(ratio, shape.shape)
+    result = np.empty((len(batch), *shape), _get_batch_dtype(batch, dtype))
+    if not callable(padding_values):
+        result[...] = padding_values
+
+    for idx, x in enumerate(batch):
+        if x.ndim != shape.size or (x.shape > shape).any():
+            raise ValueError(f'The resulting shape cannot be smaller than the original: {x.shape} vs {tuple(shape)}')
+
+        delta = shape - x.shape
+        if callable(padding_values):
+            result[idx] = padding_values(x)
+
+        start = (delta * ratio).astype(int)
+        result[idx][build_slices(start, start + x.shape)] = x
+
+    return result
 
 
 def unpack_args(func: Callable, *args, **kwargs):
@@ -107,10 +182,11 @@ def random_apply(p: float, func: Callable, *args, **kwargs):
     Returns a function that applies ``func`` with a given probability ``p``.
 
     ``args`` and ``kwargs`` are passed to ``func`` as additional arguments.
+    The decision is drawn from `get_random_state`.
     """
 
     def wrapped(*args_, **kwargs_):
-        if np.random.binomial(1, p):
+        if get_random_state().binomial(1, p):
             return func(*args_, *args, **kwargs_, **kwargs)
         return squeeze_first(args_)
 
@@ -122,6 +198,7 @@ def sample_args(func: Callable, *args: Callable, **kwargs: Callable):
     Returns a function that samples arguments for ``func`` from ``args`` and ``kwargs``.
 
     Each argument in ``args`` and ``kwargs`` must be a callable that samples a random value.
+    The functions from ``numpy.random`` (e.g. `numpy.random.normal`) draw from `get_random_state`.
 
     Examples
     --------
@@ -133,7 +210,12 @@ def sample_args(func: Callable, *args: Callable, **kwargs: Callable):
     >>> rotate(x, angle=np.random.normal())
     """
 
+    def draw(sampler):
+        if getattr(sampler, '__self__', None) is _global_random_state:
+            sampler = getattr(get_random_state(), sampler.__name__)
+        return sampler()
+
     def wrapped(*args_, **kwargs_):
-        return func(*args_, *([arg() for arg in args]), **kwargs_, **{name: arg() for name, arg in kwargs.items()})
+        return func(*args_, *map(draw, args), **kwargs_, **{name: draw(arg) for name, arg in kwargs.items()})
 
     return wrapped
@@ -4,13 +4,14 @@ import shutil
 import atexit
 from pathlib import Path
 from collections import defaultdict
-from typing import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Tuple
 
 import numpy as np
 from tqdm import tqdm
 
 from .io import save_json, save_numpy, load, PathLike
-from dpipe.itertools import collect
+from dpipe.itertools import collect, executor_map
 
 
 def populate(path: PathLike, func: Callable, *args, **kwargs):
@@ -84,6 +85,28 @@ def load_from_folder(path: str, loader=load):
         yield np_filename2id(filename), loader(os.path.join(path, filename))
 
 
+def stream_from_folder(path: PathLike, loader: Callable = load, n_workers: int = 1,
+                       prefetch: int = None) -> Iterator[Tuple[str, object]]:
+    """
+    Lazily yields (id, object) pairs loaded from ``path`` in the same order as `load_from_folder`.
+
+    The files are loaded by a pool of ``n_workers`` threads, and at most ``prefetch`` objects are loaded ahead,
+    so the memory consumption stays bounded regardless of the number of files.
+    By default the files are loaded by a single thread, so ``loader`` doesn't have to be thread-safe.
+    If ``prefetch`` is None - ``2 * os.cpu_count()`` is used.
+    """
+    return _stream_ids(lambda identifier, file: loader(file), path, n_workers, prefetch)
+
+
+def _stream_ids(load_fn: Callable, path: PathLike, n_workers: int, prefetch: int):
+    def load_file(filename):
+        identifier = np_filename2id(filename)
+        return identifier, load_fn(identifier, os.path.join(path, filename))
+
+    with ThreadPoolExecutor(n_workers) as executor:
+        yield from executor_map(executor, load_file, sorted(os.listdir(path)), prefetch)
+
+
 def map_ids_to_disk(func: Callable[[str], object], ids: Iterable[str], output_path: str,
                     exist_ok: bool = False, save: Callable = save_numpy):
     """
@@ -104,28 +127,43 @@ def predict(ids, output_path, load_x, predict_fn, exist_ok=False, save=save_nump
     map_ids_to_disk(lambda identifier: predict_fn(load_x(identifier)), tqdm(ids), output_path, exist_ok, save)
 
 
-def evaluate_aggregated_metrics(load_y_true, metrics: dict, predictions_path, results_path, exist_ok=False):
+def _stream_targets_and_predictions(load_y_true: Callable, predictions_path, loader: Callable, n_workers: int,
+                                    prefetch: int):
+    """Yields (id, (target, prediction)) pairs. The targets and the predictions are loaded in parallel."""
+    return tqdm(_stream_ids(
+        lambda identifier, file: (load_y_true(identifier), loader(file)), predictions_path, n_workers, prefetch
+    ), total=len(os.listdir(predictions_path)))
+
+
+def evaluate_aggregated_metrics(load_y_true, metrics: dict, predictions_path, results_path, exist_ok=False,
+                                loader: Callable = load, n_workers: int = 1, prefetch: int = None):
     assert len(metrics) > 0, 'No metric provided'
     os.makedirs(results_path, exist_ok=exist_ok)
 
     targets, predictions = [], []
-    for identifier, prediction in tqdm(load_from_folder(predictions_path)):
+    pairs = _stream_targets_and_predictions(load_y_true, predictions_path, loader, n_workers, prefetch)
+    for _, (target, prediction) in pairs:
         predictions.append(prediction)
-        targets.append(load_y_true(identifier))
+        targets.append(target)
 
     for name, metric in metrics.items():
         save_json(metric(targets, predictions), os.path.join(results_path, name + '.json'), indent=0)
 
 
 def evaluate_individual_metrics(load_y_true, metrics: dict, predictions_path, results_path, exist_ok=False,
-                                loader: Callable = load):
+                                loader: Callable = load, n_workers: int = 1, prefetch: int = None):
+    """
+    Calculates the ``metrics`` for each prediction from ``predictions_path``.
+    The predictions and targets are loaded by ``n_workers`` threads, and at most ``prefetch``
+    of them are kept in memory at the same time. Use ``n_workers > 1`` only if ``load_y_true`` and ``loader``
+    are thread-safe.
+    """
     assert len(metrics) > 0, 'No metric provided'
     os.makedirs(results_path, exist_ok=exist_ok)
 
     results = defaultdict(dict)
-    for identifier, prediction in tqdm(load_from_folder(predictions_path, loader=loader)):
-        target = load_y_true(identifier)
-
+    pairs = _stream_targets_and_predictions(load_y_true, predictions_path, loader, n_workers, prefetch)
+    for identifier, (target, prediction) in pairs:
         for metric_name, metric in metrics.items():
             results[metric_name][identifier] = metric(target, prediction)
 
@@ -0,0 +1,156 @@
+import numpy as np
+import pytest
+
+from dpipe.dataset.wrappers import (
+    cache_methods_to_disk, cache_methods_to_bytes, get_nbytes, cache_methods_to_shared, SharedStore,
+    cache_methods_to_chunks,
+)
+from dpipe.io import save_pickle, ChunkedArray
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+
+    def load_image(self, identifier):
+        self.calls += 1
+        return np.full((4, 5), int(identifier), dtype=np.int16)
+
+
+def test_cache_to_disk_mmap(tmpdir):
+    dataset = Counter()
+    cached = cache_methods_to_disk(dataset, tmpdir, mmap_mode='r', load_image='images')
+
+    for _ in range(2):
+        for identifier in ['1', '2']:
+            image = cached.load_image(identifier)
+            assert isinstance(image, np.memmap)
+            assert image.dtype == np.int16
+            np.testing.assert_array_equal(image, dataset.load_image(identifier))
+
+    assert dataset.calls == 2 + 4
+
+    with pytest.raises(ValueError):
+        cache_methods_to_disk(dataset, tmpdir, saver=save_pickle, loader=np.load, mmap_mode='r', load_image='images')
+
+
+def test_cache_to_disk_mmap_objects(tmpdir):
+    class Meta:
+        def load_meta(self, identifier):
+            return {'id': identifier}
+
+    cached = cache_methods_to_disk(Meta(), tmpdir, mmap_mode='r', load_meta='meta')
+    assert cached.load_meta('1') == {'id': '1'}
+    # arrays of objects are loaded without memory-mapping
+    assert cached.load_meta('1').item() == {'id': '1'}
+
+
+class Volumes:
+    def load_image(self, identifier):
+        return np.zeros(100, np.uint8) + identifier
+
+    def load_label(self, identifier):
+        return identifier % 2
+
+
+def test_cache_to_bytes(tmpdir):
+    for spill_path in [None, tmpdir]:
+        dataset = cache_methods_to_bytes(Volumes(), max_bytes=250, spill_path=spill_path)
+        for identifier in [0, 1, 0, 2, 0, 1]:
+            np.testing.assert_array_equal(dataset.load_image(identifier), identifier)
+
+        info = dataset.load_image.cache_info()
+        assert info.hits == 2
+        assert info.evictions == 2
+        assert info.nbytes == 200
+        if spill_path is None:
+            assert info.misses == 4 and info.disk_hits == 0
+        else:
+            assert info.misses == 3 and info.disk_hits == 1
+
+        assert dataset.load_label(3) == 1
+        assert dataset.load_label.cache_info() == dataset.load_image.cache_info()
+
+        dataset.load_image.cache_clear()
+        assert dataset.load_image.cache_info().nbytes == 0
+        if spill_path is not None:
+            assert not tmpdir.listdir()
+
+
+def test_cache_to_bytes_oversized(tmpdir):
+    class Large(Volumes):
+        def load_large(self, identifier):
+            return np.zeros(5000, np.uint8)
+
+    for spill_path in [None, tmpdir]:
+        dataset = cache_methods_to_bytes(Large(), max_bytes=1000, spill_path=spill_path)
+        for identifier in range(5):
+            dataset.load_image(identifier)
+
+        dataset.load_large(0)
+        info = dataset.load_image.cache_info()
+        assert info.nbytes == 500 and info.evictions == 0
+
+        dataset.load_large(0)
+        # the existing entries are still in memory
+        dataset.load_image(0)
+        info = dataset.load_image.cache_info()
+        assert info.hits == 1 and info.nbytes == 500
+        if spill_path is None:
+            assert info.misses == 7 and info.disk_hits == 0
+        else:
+            assert info.misses == 6 and info.disk_hits == 1
+
+
+def test_get_nbytes():
+    x = np.zeros((10, 10))
+    assert get_nbytes(x) == 800
+    assert get_nbytes((x, x[0])) > 880
+
+
+def test_cache_to_shared(tmpdir):
+    dataset = Counter()
+    cached = cache_methods_to_shared(dataset, ['load_image'], path=tmpdir)
+    other = cache_methods_to_shared(Counter(), ['load_image'], path=tmpdir)
+
+    for identifier in ['1', '2', '1']:
+        image = cached.load_image(identifier)
+        assert isinstance(image, np.memmap)
+        assert not image.flags.writeable
+        np.testing.assert_array_equal(image, int(identifier))
+        np.testing.assert_array_equal(other.load_image(identifier), image)
+
+    assert dataset.calls == 2
+    assert other.calls == 0
+    assert len(tmpdir.listdir()) == 2
+
+
+def test_shared_store_temporary():
+    store = SharedStore()
+    path = store.path
+    assert store.get(('x', 1), lambda: {'a': 1}) == {'a': 1}
+    assert store.get(('x', 1), lambda: None) == {'a': 1}
+
+    del store
+    assert not path.exists()
+
+
+def test_cache_to_chunks(tmpdir):
+    dataset = Counter()
+    cached = cache_methods_to_chunks(dataset, tmpdir, chunks=2, load_image='images')
+    for _ in range(2):
+        image = cached.load_image('3')
+        assert isinstance(image, ChunkedArray)
+        np.testing.assert_array_equal(image[1:3, 2:], 3)
+
+    assert dataset.calls == 1
+
+
+def test_cache_to_disk_compressed(tmpdir):
+    dataset = Counter()
+    cached = cache_methods_to_disk(dataset, tmpdir, extension='.npc', load_image='images')
+    for _ in range(2):
+        np.testing.assert_array_equal(cached.load_image('5'), 5)
+
+    assert dataset.calls == 1
+    assert (tmpdir / 'images' / '5.npc').exists()
@@ -3,18 +3,30 @@ Wrappers change the dataset's behaviour.
 See the :doc:`tutorials/wrappers` tutorial for more details.
 """
 import functools
+import hashlib
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import weakref
 from itertools import chain
 from types import MethodType, FunctionType
-from typing import Sequence, Callable, Iterable
-from collections import ChainMap, namedtuple
+from typing import Sequence, Callable, Iterable, NamedTuple
+from collections import ChainMap, namedtuple, OrderedDict
 from pathlib import Path
 
 import numpy as np
 
 from dpipe.checks import join
-from dpipe.io import save_numpy, PathLike, load_or_create, load_numpy
+from dpipe.io import (
+    save_numpy, PathLike, load_or_create, load_numpy, load, save, save_pickle, load_pickle, save_chunked, load_chunked,
+    ChunkedArray,
+)
 from dpipe.itertools import zdict
 from dpipe.im.preprocessing import normalize
+from dpipe.im.axes import AxesLike
 from .base import Dataset
 
 
@@ -48,8 +60,290 @@ def cache_methods(instance, methods: Iterable[str] = None, maxsize: int = None):
     return proxy(instance)
 
 
-def cache_methods_to_disk(instance, base_path: PathLike, loader: Callable = load_numpy, saver: Callable = save_numpy,
-                          **methods: str):
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    disk_hits: int
+    nbytes: int
+    max_bytes: int
+
+
+def get_nbytes(value) -> int:
+    """Estimate the memory occupied by ``value``. Arrays are measured by ``nbytes``, containers - recursively."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return sys.getsizeof(value) + sum(map(get_nbytes, value))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(map(get_nbytes, chain(value.keys(), value.values())))
+    return sys.getsizeof(value)
+
+
+class BytesLRUCache:
+    """
+    A thread-safe least-recently-used cache, whose size is limited in bytes rather than in the number of entries.
+
+    Parameters
+    ----------
+    max_bytes: int
+        the memory budget. The least recently used entries are evicted when it is exceeded.
+        Entries larger than the whole budget are not cached in memory, but are still spilled to ``spill_path``.
+    spill_path: PathLike, None, optional
+        if not None - the evicted entries are pickled to this folder and loaded back on the next access
+        instead of being recomputed.
+    """
+
+    def __init__(self, max_bytes: int, spill_path: PathLike = None):
+        if spill_path is not None:
+            spill_path = Path(spill_path)
+            spill_path.mkdir(parents=True, exist_ok=True)
+
+        self.max_bytes = max_bytes
+        self.spill_path = spill_path
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._spilled = {}
+        self._spill_counter = 0
+        self._nbytes = self._hits = self._misses = self._evictions = self._disk_hits = 0
+
+    def get(self, key, create: Callable):
+        """Returns the value cached under ``key``. If there is none - ``create()`` is called and cached."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key][0]
+
+            spilled = self._spilled.get(key)
+            if spilled is None:
+                self._misses += 1
+            else:
+                self._disk_hits += 1
+
+        # the heavy lifting is done outside the lock
+        value = create() if spilled is None else load_pickle(spilled)
+        self._add(key, value)
+        return value
+
+    def _add(self, key, value):
+        nbytes = get_nbytes(value)
+        if nbytes > self.max_bytes:
+            # caching it in memory would only evict all the other entries
+            if self.spill_path is not None:
+                self._spill(key, value)
+            return
+
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                return
+
+            self._entries[key] = value, nbytes
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                evicted_key, (evicted_value, evicted_nbytes) = self._entries.popitem(last=False)
+                self._nbytes -= evicted_nbytes
+                self._evictions += 1
+                evicted.append((evicted_key, evicted_value))
+
+        if self.spill_path is not None:
+            for evicted_key, evicted_value in evicted:
+                self._spill(evicted_key, evicted_value)
+
+    def _spill(self, key, value):
+        with self._lock:
+            if key in self._spilled:
+                return
+            file = self.spill_path / f'{self._spill_counter}.pkl'
+            self._spill_counter += 1
+
+        save_pickle(value, file)
+        with self._lock:
+            self._spilled[key] = file
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._evictions, self._disk_hits, self._nbytes, self.max_bytes)
+
+    def clear(self):
+        """Drop all the entries, remove the spilled files and reset the statistics."""
+        with self._lock:
+            spilled = list(self._spilled.values())
+            self._entries.clear()
+            self._spilled.clear()
+            self._nbytes = self._hits = self._misses = self._evictions = self._disk_hits = 0
+
+        for file in spilled:
+            if file.exists():
+                os.remove(file)
+
+
+def cache_methods_to_bytes(instance, max_bytes: int, methods: Iterable[str] = None, spill_path: PathLike = None):
+    """
+    Cache the ``instance``'s ``methods`` in a single LRU cache limited to ``max_bytes``.
+    If ``methods`` is None, all public methods will be cached.
+
+    Unlike `cache_methods`, the cache is bounded by the memory it occupies, not by the number of entries,
+    so large volumes and tiny labels can be cached together.
+
+    Parameters
+    ----------
+    instance
+        arbitrary object
+    max_bytes: int
+        the memory budget shared by all the ``methods``.
+    methods: Iterable[str], None, optional
+        the names of the methods to cache.
+    spill_path: PathLike, None, optional
+        if not None - the evicted entries are spilled to this folder instead of being discarded.
+
+    Notes
+    -----
+    Each cached method has the ``cache_info()`` and ``cache_clear()`` functions, similarly to `functools.lru_cache`.
+    ``cache_info()`` returns the hits, misses, evictions and disk hits statistics of the shared cache.
+
+    Examples
+    --------
+    >>> dataset = cache_methods_to_bytes(base_dataset, max_bytes=16 * 2 ** 30)
+    >>> image = dataset.load_image(identifier)
+    >>> dataset.load_image.cache_info()
+    CacheInfo(hits=0, misses=1, evictions=0, disk_hits=0, nbytes=134217728, max_bytes=17179869184)
+    """
+    if methods is None:
+        methods = _get_public_methods(instance)
+
+    cache = BytesLRUCache(max_bytes, spill_path)
+
+    def decorator(name):
+        method = getattr(instance, name)
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            return cache.get((name, args, tuple(kwargs.items())), lambda: method(*args, **kwargs))
+
+        wrapper.cache_info = cache.info
+        wrapper.cache_clear = cache.clear
+        return staticmethod(wrapper)
+
+    new_methods = {method: decorator(method) for method in methods}
+    proxy = type('CachedToBytes', (Proxy,), new_methods)
+    return proxy(instance)
+
+
+class SharedStore:
+    """
+    A file-backed key-value store shared by several processes.
+
+    Arrays are stored as ``.npy`` files and opened with ``mmap_mode='r'``, so all the processes see a single copy
+    of each array in the OS page cache. Other values are pickled. Reads are lock-free: the files are written
+    to a temporary location and atomically renamed, so a reader never sees a partially written entry.
+
+    Parameters
+    ----------
+    path: PathLike, None, optional
+        the folder to store the entries in. If None - a temporary folder is created in ``/dev/shm``
+        (or in the default temporary location, if it is not available) and removed when the store is
+        garbage collected by the process that created it.
+    """
+
+    def __init__(self, path: PathLike = None):
+        if path is None:
+            shm = '/dev/shm'
+            path = tempfile.mkdtemp(prefix='dpipe-', dir=shm if os.path.isdir(shm) else None)
+            pid = os.getpid()
+            # the forked workers must not remove the store
+            weakref.finalize(self, lambda: os.getpid() == pid and shutil.rmtree(path, ignore_errors=True))
+
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _get_file(self, key) -> Path:
+        # the name must be the same in all the processes, so the builtin `hash` can't be used
+        return self.path / hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def get(self, key, create: Callable):
+        """Returns the value stored under ``key``. If there is none - ``create()`` is called and stored."""
+        file = self._get_file(key)
+        try:
+            return load_numpy(file.with_suffix('.npy'), mmap_mode='r')
+        except FileNotFoundError:
+            pass
+        try:
+            return load_pickle(file.with_suffix('.pkl'))
+        except FileNotFoundError:
+            pass
+
+        value = create()
+        # empty arrays can't be memory-mapped
+        if isinstance(value, np.ndarray) and not value.dtype.hasobject and value.size:
+            file = file.with_suffix('.npy')
+            self._write(file, functools.partial(np.save, arr=value, allow_pickle=False))
+            return load_numpy(file, mmap_mode='r')
+
+        self._write(file.with_suffix('.pkl'), functools.partial(pickle.dump, value))
+        return value
+
+    @staticmethod
+    def _write(file: Path, dump: Callable):
+        temp = file.with_name(f'{file.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            with open(temp, 'wb') as fd:
+                dump(fd)
+            os.replace(temp, file)
+        finally:
+            if temp.exists():
+                temp.unlink()
+
+
+def cache_methods_to_shared(instance, methods: Iterable[str] = None, path: PathLike = None):
+    """
+    Cache the ``instance``'s ``methods`` in a `SharedStore`, which is visible to all the processes
+    that have access to ``path``, e.g. to the ``'process'`` workers of `Parallel`.
+    If ``methods`` is None, all public methods will be cached.
+
+    Unlike `cache_methods`, each value is computed and stored only once, instead of once per process,
+    and the cached arrays are read-only memory maps.
+
+    Parameters
+    ----------
+    instance
+        arbitrary object
+    methods: Iterable[str], None, optional
+        the names of the methods to cache.
+    path: PathLike, None, optional
+        the folder to store the cache in. If None - a temporary folder in shared memory is used.
+
+    Examples
+    --------
+    >>> dataset = cache_methods_to_shared(apply(base_dataset, load_image=normalize), ['load_image'])
+    >>> batch_iter = Infinite(
+    >>>     load_by_random_id(dataset.load_image, dataset.load_segm, ids=train_ids),
+    >>>     Parallel(random_patch, n_workers=8, backend='process'),
+    >>>     batch_size=batch_size, batches_per_epoch=batches_per_epoch,
+    >>> )
+    """
+    if methods is None:
+        methods = _get_public_methods(instance)
+
+    store = SharedStore(path)
+
+    def decorator(name):
+        method = getattr(instance, name)
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            return store.get((name, args, tuple(kwargs.items())), lambda: method(*args, **kwargs))
+
+        return staticmethod(wrapper)
+
+    new_methods = {method: decorator(method) for method in methods}
+    proxy = type('CachedToShared', (Proxy,), new_methods)
+    return proxy(instance)
+
+
+def cache_methods_to_disk(instance, base_path: PathLike, loader: Callable = None, saver: Callable = None,
+                          mmap_mode: str = None, extension: str = '.npy', **methods: str):
     """
     Cache the ``instance``'s ``methods`` to disk.
 
@@ -63,11 +357,33 @@ def cache_methods_to_disk(instance, base_path: PathLike, loader: Callable = load
         each keyword argument has the form ``method_name=path_to_cache``.
         The methods are assumed to take a single argument of type ``str``.
     loader
-        loads a single object given its path.
+        loads a single object given its path. Defaults to `load_numpy` for ``.npy`` files,
+        and to `load` otherwise.
     saver: Callable(value, path)
-        saves a single object to the given path.
+        saves a single object to the given path. Defaults to `save_numpy` for ``.npy`` files,
+        and to `save` otherwise.
+    mmap_mode: str, None, optional
+        if not None - the cached arrays are memory-mapped with the given mode, e.g. ``'r'``,
+        instead of being read fully. This way only the accessed pages are loaded, and several processes
+        share the OS page cache. Only supported by the default ``loader`` for ``.npy`` files.
+    extension: str
+        the extension of the cache files, e.g. ``'.npc'`` to store compressed arrays.
+
+    Examples
+    --------
+    >>> dataset = cache_methods_to_disk(base_dataset, 'cache', mmap_mode='r', load_image='images')
+    >>> # compressed cache
+    >>> dataset = cache_methods_to_disk(base_dataset, 'cache', extension='.npc', load_image='images')
     """
     base_path = Path(base_path)
+    if loader is None:
+        loader = load_numpy if extension == '.npy' else load
+    if saver is None:
+        saver = save_numpy if extension == '.npy' else save
+    if mmap_mode is not None:
+        if loader is not load_numpy:
+            raise ValueError('`mmap_mode` is only supported by the default loader.')
+        loader = functools.partial(load_numpy, mmap_mode=mmap_mode)
 
     def decorator(method, folder):
         method = getattr(instance, method)
@@ -76,8 +392,13 @@ def cache_methods_to_disk(instance, base_path: PathLike, loader: Callable = load
 
         @functools.wraps(method)
         def wrapper(identifier, *args, **kwargs):
-            return load_or_create(
-                path / f'{identifier}.npy', method, identifier, *args, **kwargs, save=saver, load=loader)
+            file = path / f'{identifier}{extension}'
+            value = load_or_create(file, method, identifier, *args, **kwargs, save=saver, load=loader)
+            if mmap_mode is not None and isinstance(value, np.ndarray) and not isinstance(value, np.memmap) \
+                    and not value.dtype.hasobject:
+                # the value was just created: return the same kind of object as the subsequent calls
+                value = loader(file)
+            return value
 
         return staticmethod(wrapper)
 
@@ -86,6 +407,52 @@ def cache_methods_to_disk(instance, base_path: PathLike, loader: Callable = load
     return proxy(instance)
 
 
+def cache_methods_to_chunks(instance, base_path: PathLike, chunks: AxesLike = 64, **methods: str):
+    """
+    Cache the ``instance``'s ``methods`` to disk in a chunked format.
+    The cached methods return a `ChunkedArray`, so extracting a patch only reads the chunks it intersects.
+
+    Parameters
+    ----------
+    instance
+        arbitrary object
+    base_path: str
+        the path, all other paths of ``methods`` relative to.
+    chunks
+        the shape of a single chunk.
+    methods: str
+        each keyword argument has the form ``method_name=path_to_cache``.
+        The methods are assumed to take a single argument of type ``str`` and return an array.
+
+    Examples
+    --------
+    >>> dataset = cache_methods_to_chunks(base_dataset, 'cache', chunks=32, load_image='images', load_segm='segms')
+    >>> image, segm = get_random_patch(dataset.load_image(i), dataset.load_segm(i), patch_size=64)
+    """
+    base_path = Path(base_path)
+    saver = functools.partial(save_chunked, chunks=chunks)
+
+    def decorator(method, folder):
+        method = getattr(instance, method)
+        path = base_path / folder
+        path.mkdir(parents=True, exist_ok=True)
+
+        @functools.wraps(method)
+        def wrapper(identifier, *args, **kwargs):
+            file = path / f'{identifier}.chunks'
+            value = load_or_create(file, method, identifier, *args, **kwargs, save=saver, load=load_chunked)
+            if not isinstance(value, ChunkedArray):
+                # the value was just created: return the same kind of object as the subsequent calls
+                value = load_chunked(file)
+            return value
+
+        return staticmethod(wrapper)
+
+    new_methods = {method: decorator(method, folder) for method, folder in methods.items()}
+    proxy = type('CachedToChunks', (Proxy,), new_methods)
+    return proxy(instance)
+
+
 def apply(instance, **methods: Callable):
     """
     Applies a given function to the output of a given method.
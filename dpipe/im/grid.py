@@ -2,18 +2,58 @@
 Function for working with patches from tensors.
 See the :doc:`tutorials/patches` tutorial for more details.
 """
-from typing import Iterable
+from functools import lru_cache
+from typing import Iterable, Callable
 
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 
-from .shape_ops import crop_to_box
 from .axes import broadcast_to_axes, fill_by_indices, AxesLike
-from .box import make_box_, Box
-from dpipe.itertools import zip_equal, peek
-from .shape_utils import shape_after_full_convolution
+from .box import Box
+from dpipe.itertools import zip_equal, peek, extract
+from .shape_utils import shape_after_full_convolution, shape_after_convolution
 from .utils import build_slices
 
-__all__ = 'get_boxes', 'divide', 'combine'
+__all__ = 'get_boxes', 'get_boxes_table', 'divide', 'divide_view', 'combine', 'GridAccumulator', 'linear_window', 'gaussian_window'
+
+
+def get_boxes_table(shape: AxesLike, box_size: AxesLike, stride: AxesLike, axes: AxesLike = None,
+                    valid: bool = True) -> np.ndarray:
+    """
+    Get all the boxes appropriate for a tensor of shape ``shape`` in a convolution-like fashion
+    as a single read-only array of shape (n_boxes, 2, len(shape)).
+
+    The boxes are ordered in the same way as in `get_boxes`. The tables are cached, so repeated calls
+    with the same arguments don't recompute the boxes.
+
+    Parameters
+    ----------
+    shape
+        the input tensor's shape.
+    box_size
+    axes
+        axes along which the slices will be taken.
+    stride
+        the stride (step-size) of the slice.
+    valid
+        whether boxes of size smaller than ``box_size`` should be left out.
+    """
+    axes, box_size, stride = broadcast_to_axes(axes, box_size, stride)
+    shape = tuple(map(int, shape))
+    axes = tuple(int(axis) % len(shape) for axis in axes)
+    return _get_boxes_table(shape, tuple(map(int, box_size)), tuple(map(int, stride)), axes, bool(valid))
+
+
+@lru_cache(16)
+def _get_boxes_table(shape, box_size, stride, axes, valid) -> np.ndarray:
+    final_shape = shape_after_full_convolution(shape, box_size, axes, stride, valid=valid)
+    full_box = fill_by_indices(shape, box_size, axes)
+    full_stride = fill_by_indices(np.ones_like(shape), stride, axes)
+
+    start = np.indices(final_shape).reshape(len(shape), -1).T * full_stride
+    table = np.stack([start, np.minimum(start + full_box, shape)], axis=1)
+    table.setflags(write=False)
+    return table
 
 
 def get_boxes(shape: AxesLike, box_size: AxesLike, stride: AxesLike, axes: AxesLike = None,
@@ -36,16 +76,9 @@ def get_boxes(shape: AxesLike, box_size: AxesLike, stride: AxesLike, axes: AxesL
     References
     ----------
     See the :doc:`tutorials/patches` tutorial for more details.
+    `get_boxes_table`
     """
-    final_shape = shape_after_full_convolution(shape, box_size, axes, stride, valid=valid)
-    box_size, stride = np.broadcast_arrays(box_size, stride)
-
-    full_box = fill_by_indices(shape, box_size, axes)
-    full_stride = fill_by_indices(np.ones_like(shape), stride, axes)
-
-    for start in np.ndindex(*final_shape):
-        start = np.asarray(start) * full_stride
-        yield make_box_([start, np.minimum(start + full_box, shape)])
+    yield from get_boxes_table(shape, box_size, stride, axes, valid)
 
 
 def divide(x: np.ndarray, patch_size: AxesLike, stride: AxesLike, axes: AxesLike = None,
@@ -67,17 +100,210 @@ def divide(x: np.ndarray, patch_size: AxesLike, stride: AxesLike, axes: AxesLike
     References
     ----------
     See the :doc:`tutorials/patches` tutorial for more details.
+    `divide_view`
+    """
+    for box in get_boxes_table(x.shape, patch_size, stride, axes, valid=valid):
+        yield x[build_slices(*box)]
+
+
+def divide_view(x: np.ndarray, patch_size: AxesLike, stride: AxesLike, axes: AxesLike = None) -> np.ndarray:
     """
-    for box in get_boxes(x.shape, patch_size, stride, axes, valid=valid):
-        yield crop_to_box(x, box)
+    A zero-copy alternative to `divide`: returns all the valid patches from ``x`` as a single read-only strided view.
+
+    The resulting array has shape ``(*grid_shape, *patch_shape)``, where ``grid_shape`` contains the number of patches
+    along each of the ``axes`` (in increasing order), and ``patch_shape`` is ``x.shape`` with ``patch_size``
+    along the ``axes``. ``divide_view(x, ...).reshape(-1, *patch_shape)`` contains the same patches
+    in the same order as ``divide(x, ..., valid=True)``, but note that the reshape produces a copy.
+
+    Parameters
+    ----------
+    x
+    patch_size
+    axes
+        dimensions along which the slices will be taken.
+    stride
+        the stride (step-size) of the slice.
+    """
+    axes, patch_size, stride = broadcast_to_axes(axes, patch_size, stride)
+    axes = [axis % x.ndim for axis in axes]
+    order = np.argsort(axes)
+    axes, patch_size, stride = np.array(axes)[order], patch_size[order], stride[order]
+
+    grid_shape = shape_after_convolution(extract(x.shape, axes), patch_size, stride)
+    patch_shape = fill_by_indices(x.shape, patch_size, axes)
+    grid_strides = [x.strides[axis] * step for axis, step in zip(axes, stride)]
+
+    return as_strided(x, (*grid_shape, *patch_shape), (*grid_strides, *x.strides), writeable=False)
+
+
+def linear_window(size: int) -> np.ndarray:
+    """A 1D window of length ``size`` that decreases linearly from its center towards the borders."""
+    return 1 - np.abs(2 * (np.arange(size) + .5) / size - 1)
+
+
+def gaussian_window(size: int, sigma: float = 1 / 8) -> np.ndarray:
+    """
+    A 1D gaussian window of length ``size`` with the maximum equal to 1.
+    ``sigma`` is the standard deviation relative to ``size``.
+    """
+    x = np.arange(size) - (size - 1) / 2
+    return np.exp(-x ** 2 / (2 * (sigma * size) ** 2))
+
+
+def _get_patch_window(window: Callable, patch_shape, axes) -> np.ndarray:
+    result = np.ones([1] * len(patch_shape))
+    for axis in axes:
+        shape = np.ones(len(patch_shape), int)
+        shape[axis] = patch_shape[axis]
+        result = result * np.reshape(window(patch_shape[axis]), shape)
+    return result
+
+
+@lru_cache(256)
+def _get_inverse_overlap(length: int, patch_size: int, stride: int, valid: bool, window: Callable) -> np.ndarray:
+    weights = np.ones(patch_size) if window is None else window(patch_size)
+    overlap = np.zeros(length)
+    n_patches, = shape_after_convolution([length], [patch_size], stride, valid=valid)
+    for start in np.arange(n_patches) * stride:
+        stop = min(start + patch_size, length)
+        overlap[start:stop] += weights[:stop - start]
+
+    inverse = np.zeros_like(overlap)
+    np.true_divide(1, overlap, out=inverse, where=overlap > 0)
+    inverse.setflags(write=False)
+    return inverse
+
+
+def _normalize_overlap_(x: np.ndarray, patch_size, stride, axes, valid: bool, window: Callable):
+    """
+    Inplace division of ``x`` by the sum of all the patch windows covering each of its elements.
+
+    The grid is a cartesian product of per-axis grids, so the normalization is separable and is applied
+    one axis at a time, without allocating an array of the same shape as ``x``.
+    """
+    for axis, size, step in zip_equal(axes, patch_size, stride):
+        inverse = _get_inverse_overlap(x.shape[axis], int(size), int(step), valid, window)
+        shape = np.ones(x.ndim, int)
+        shape[axis] = -1
+        x *= inverse.reshape(shape)
+
+
+class GridAccumulator:
+    """
+    Incrementally build a tensor of shape ``output_shape`` from patches obtained in a convolution-like approach
+    with corresponding parameters. The overlapping parts are averaged.
+
+    The patches are identified by their index in the grid, i.e. the same order as in `divide` and `get_boxes`,
+    and can be added in any order, e.g. as they arrive from a queue or a remote worker.
+
+    Parameters
+    ----------
+    output_shape
+        the full shape of the resulting tensor.
+    patch_size
+    stride
+    axes
+    valid
+    window: Callable(size), None, optional
+        a function that returns 1D weights of length ``size``, e.g. `gaussian_window` or `linear_window`.
+    dtype
+        the data type used for accumulation. Must be floating. Ignored if ``out`` is provided.
+    out: np.ndarray, None, optional
+        the array to accumulate the patches into, e.g. a `numpy.memmap`, if the result doesn't fit in memory.
+        Its contents are overwritten.
+
+    Examples
+    --------
+    >>> accumulator = GridAccumulator(x.shape, patch_size, stride)
+    >>> for index, patch in results_queue:
+    >>>     accumulator.add(index, patch)
+    >>> result = accumulator.finalize()
+
+    Notes
+    -----
+    The accumulator is not thread-safe.
+    """
+
+    def __init__(self, output_shape: AxesLike, patch_size: AxesLike, stride: AxesLike, axes: AxesLike = None,
+                 valid: bool = False, window: Callable = None, dtype=float, out: np.ndarray = None):
+        axes, patch_size, stride = broadcast_to_axes(axes, patch_size, stride)
+        output_shape = tuple(output_shape)
+
+        if out is None:
+            out = np.zeros(output_shape, dtype)
+        else:
+            if out.shape != output_shape:
+                raise ValueError(f'The output array has shape {out.shape}, but {output_shape} is expected.')
+            out.fill(0)
+        if not np.issubdtype(out.dtype, np.floating):
+            raise ValueError(f'The accumulation dtype must be floating, not {out.dtype}.')
+
+        self.boxes = get_boxes_table(output_shape, patch_size, stride, axes, valid)
+        self.patch_size, self.stride, self.axes, self.valid, self.window = patch_size, stride, axes, valid, window
+        self._result = out
+        self._added = np.zeros(len(self.boxes), bool)
+        self._weights = None
+        if window is not None:
+            patch_shape = fill_by_indices(output_shape, patch_size, axes)
+            self._weights = _get_patch_window(window, patch_shape, axes).astype(out.dtype)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @property
+    def n_added(self) -> int:
+        return int(self._added.sum())
+
+    def add(self, index: int, patch: np.ndarray):
+        """Add the ``patch`` located at position ``index`` of the grid."""
+        if self._result is None:
+            raise RuntimeError('The accumulator is already finalized.')
+        if self._added[index]:
+            raise ValueError(f'The patch with index {index} was already added.')
+
+        box = self.boxes[index]
+        if patch.shape != tuple(box[1] - box[0]):
+            raise ValueError(f'The patch with index {index} must have shape {tuple(box[1] - box[0])}, '
+                             f'but {patch.shape} provided.')
+
+        if self._weights is not None:
+            patch = patch * self._weights[build_slices(box[1] - box[0])]
+        self._result[build_slices(*box)] += patch
+        self._added[index] = True
+
+    def finalize(self) -> np.ndarray:
+        """Normalize the overlapping regions and return the resulting tensor. All the patches must be added."""
+        if self._result is None:
+            raise RuntimeError('The accumulator is already finalized.')
+        if not self._added.all():
+            raise ValueError(f'Not all the patches were added: {self.n_added} out of {len(self)}.')
+
+        result, self._result = self._result, None
+        _normalize_overlap_(result, self.patch_size, self.stride, self.axes, self.valid, self.window)
+        return result
 
 
 def combine(patches: Iterable[np.ndarray], output_shape: AxesLike, stride: AxesLike,
-            axes: AxesLike = None, valid: bool = False) -> np.ndarray:
+            axes: AxesLike = None, valid: bool = False, window: Callable = None, dtype=None) -> np.ndarray:
     """
     Build a tensor of shape ``output_shape`` from ``patches`` obtained in a convolution-like approach
     with corresponding parameters. The overlapping parts are averaged.
 
+    Parameters
+    ----------
+    patches
+    output_shape
+    stride
+    axes
+    valid
+    window: Callable(size), None, optional
+        a function that returns 1D weights of length ``size``, e.g. `gaussian_window` or `linear_window`.
+        If not None - the overlapping parts are averaged with weights given by the outer product of ``window``
+        along each of the ``axes``, which helps hiding seams between neighbouring patches.
+    dtype
+        the data type used for accumulation and of the resulting tensor.
+        If None - the patches' data type is used if it's floating, otherwise - ``float``.
+
     References
     ----------
     See the :doc:`tutorials/patches` tutorial for more details.
@@ -88,16 +314,13 @@ def combine(patches: Iterable[np.ndarray], output_shape: AxesLike, stride: AxesL
     if len(np.atleast_1d(output_shape)) != patch.ndim:
         output_shape = fill_by_indices(patch.shape, output_shape, axes)
 
-    dtype = patch.dtype
-    if not np.issubdtype(dtype, np.floating):
-        dtype = float
+    if dtype is None:
+        dtype = patch.dtype
+        if not np.issubdtype(dtype, np.floating):
+            dtype = float
 
-    result = np.zeros(output_shape, dtype)
-    counts = np.zeros(output_shape, int)
-    for box, patch in zip_equal(get_boxes(output_shape, patch_size, stride, axes, valid), patches):
-        slc = build_slices(*box)
-        result[slc] += patch
-        counts[slc] += 1
+    accumulator = GridAccumulator(output_shape, patch_size, stride, axes, valid, window, dtype)
+    for index, patch in zip_equal(range(len(accumulator)), patches):
+        accumulator.add(index, patch)
 
-    np.true_divide(result, counts, out=result, where=counts > 0)
-    return result
+    return accumulator.finalize()
@@ -1,13 +1,13 @@
 """
 Tools for patch extraction and generation.
 """
-from typing import Callable
+from typing import Callable, Sequence, Union
 
 import numpy as np
 
 from .shape_ops import crop_to_box
 from .box import returns_box
-from .axes import expand_axes, fill_by_indices, AxesLike
+from .axes import expand_axes, fill_by_indices, broadcast_to_axes, AxesLike
 from .shape_utils import shape_after_convolution, shape_after_full_convolution
 from ..checks import check_shape_along_axis
 from dpipe.itertools import squeeze_first, extract, lmap
@@ -49,9 +49,208 @@ def get_random_patch(*arrays: np.ndarray, patch_size: AxesLike, axes: AxesLike =
     return squeeze_first(tuple(crop_to_box(arr, box, axes) for arr in arrays))
 
 
+def extract_patches(x: Union[np.ndarray, Sequence[np.ndarray]], starts: np.ndarray, patch_size: AxesLike,
+                    axes: AxesLike = None, indices: Sequence[int] = None, out: np.ndarray = None) -> np.ndarray:
+    """
+    Extract ``len(starts)`` patches of size ``patch_size`` along the ``axes`` into a single array
+    of shape ``(len(starts), *patch_shape)``.
+
+    The patches from each array are gathered with a single fancy-indexing operation, so there is no per-patch
+    Python overhead, and only the required elements are read from memory-mapped arrays.
+
+    Parameters
+    ----------
+    x: np.ndarray, Sequence[np.ndarray]
+        a single array or a sequence of arrays with equal shapes outside the ``axes``.
+    starts: np.ndarray
+        array of shape ``(n_patches, len(axes))`` with the start position of each patch.
+    patch_size
+    axes
+    indices: Sequence[int], None, optional
+        the index of the array in ``x`` each patch is taken from. If None - the i-th patch is taken from ``x[i]``.
+        Ignored if ``x`` is a single array.
+    out: np.ndarray, None, optional
+        the preallocated array to write the patches to.
+    """
+    starts = np.asarray(starts)
+    if starts.ndim != 2:
+        raise ValueError(f'`starts` must be 2D, but {starts.ndim}D provided.')
+
+    if isinstance(x, np.ndarray):
+        x, indices = [x], np.zeros(len(starts), int)
+    elif indices is None:
+        indices = np.arange(len(starts))
+    indices = np.asarray(indices)
+    if not x:
+        raise ValueError('No arrays given.')
+    if len(indices) != len(starts):
+        raise ValueError(f'The number of indices and starts must match: {len(indices)} vs {len(starts)}.')
+
+    ndim = x[0].ndim
+    axes, patch_size, _ = broadcast_to_axes(axes, patch_size, np.zeros(starts.shape[1]))
+    axes = tuple(np.array(axes) % ndim)
+    shape = (len(starts), *fill_by_indices(x[0].shape, patch_size, axes))
+    if any(arr.ndim != ndim or fill_by_indices(arr.shape, patch_size, axes) != shape[1:] for arr in x):
+        raise ValueError('The arrays must have equal shapes outside the `axes`.')
+    if out is None:
+        out = np.empty(shape, np.result_type(*x))
+    elif out.shape != shape:
+        raise ValueError(f'`out` has wrong shape: {out.shape} instead of {shape}.')
+
+    # group the patches by the source array
+    order = np.argsort(indices, kind='stable')
+    values, bounds = np.unique(indices[order], return_index=True)
+    for value, selected in zip(values, np.split(order, bounds[1:])):
+        out[selected] = _gather_patches(x[value], starts[selected], patch_size, axes)
+
+    return out
+
+
+def _gather_patches(x: np.ndarray, starts: np.ndarray, patch_size: np.ndarray, axes: tuple) -> np.ndarray:
+    limits = extract(x.shape, axes)
+    if (starts < 0).any() or (starts + patch_size > limits).any():
+        raise ValueError(f"The patches exceed the input's limits {x.shape}.")
+
+    n, rest = len(axes), x.ndim - len(axes)
+    # move the patch axes to the end and index them with broadcastable open grids
+    x = np.moveaxis(x, axes, list(range(rest, x.ndim)))
+    grids = []
+    for i, size in enumerate(patch_size):
+        grid_shape = np.ones(n + 1, int)
+        grid_shape[[0, i + 1]] = len(starts), size
+        grids.append((starts[:, [i]] + np.arange(size)).reshape(grid_shape))
+
+    # (*rest, n_patches, *patch_size) -> (n_patches, *patch_shape)
+    patches = np.moveaxis(x[(..., *grids)], rest, 0)
+    return np.moveaxis(patches, list(range(rest + 1, rest + 1 + n)), [axis + 1 for axis in axes])
+
+
+def get_random_patches(*arrays: np.ndarray, patch_size: AxesLike, n_patches: int, axes: AxesLike = None,
+                       distribution: Callable = uniform):
+    """
+    A batched version of `get_random_patch`: get ``n_patches`` random patches of size ``path_size``
+    along the ``axes`` for each of the ``arrays``, stacked into arrays of shape ``(n_patches, *patch_shape)``.
+    The patch positions are equal for all the ``arrays``.
+
+    Parameters
+    ----------
+    arrays
+    patch_size
+    n_patches
+    axes
+    distribution: Callable(shape)
+        function that samples a random number in the range ``[0, n)`` for each axis. Defaults to a uniform distribution.
+    """
+    if not arrays:
+        raise ValueError('No arrays given.')
+
+    axes = expand_axes(axes, patch_size)
+    check_shape_along_axis(*arrays, axis=axes)
+
+    shape = shape_after_convolution(extract(arrays[0].shape, axes), patch_size)
+    starts = np.array([distribution(shape) for _ in range(n_patches)], int).reshape(n_patches, len(axes))
+    return squeeze_first(tuple(extract_patches(arr, starts, patch_size, axes) for arr in arrays))
+
+
 # TODO: what to do if axis != None?
 @returns_box
 def get_random_box(shape: AxesLike, box_shape: AxesLike, axes: AxesLike = None, distribution: Callable = uniform):
     """Get a random box of shape ``box_shape`` that fits in the ``shape`` along the given ``axes``."""
     start = distribution(shape_after_full_convolution(shape, box_shape, axes))
     return start, start + fill_by_indices(shape, box_shape, axes)
+
+
+class LabelIndex:
+    """
+    Precomputed coordinates of the voxels of each label in ``mask``, which allows to draw a random voxel
+    of a given label in O(1) instead of calling ``np.argwhere`` on the whole mask.
+
+    The index is built in a single pass over the mask and is picklable, so it can be cached,
+    e.g. with `cache_methods` or `cache_methods_to_disk` using `save_pickle` and `load_pickle`.
+
+    Parameters
+    ----------
+    mask: np.ndarray
+        integer or boolean mask.
+    labels: Sequence, None, optional
+        the labels to index. If None - all the labels present in ``mask`` are indexed.
+        Indexing only the foreground labels saves memory for large volumes.
+
+    Examples
+    --------
+    >>> label_index = cache_methods(apply(dataset, load_segm=LabelIndex)).load_segm
+    >>> batch_iter = Infinite(
+    >>>     load_by_random_id(dataset.load_image, dataset.load_segm, label_index, ids=train_ids),
+    >>>     unpack_args(lambda image, segm, index: get_random_patch(
+    >>>         image, segm, patch_size=patch_size, distribution=index.distribution(patch_size, label=1),
+    >>>     )),
+    >>>     batch_size=batch_size, batches_per_epoch=batches_per_epoch,
+    >>> )
+    """
+
+    def __init__(self, mask: np.ndarray, labels: Sequence = None):
+        mask = np.asarray(mask)
+        flat = mask.ravel()
+        dtype = np.uint32 if flat.size <= np.iinfo(np.uint32).max else np.int64
+
+        if labels is None:
+            indices = np.argsort(flat, kind='stable').astype(dtype)
+        else:
+            indices = np.flatnonzero(np.isin(flat, labels)).astype(dtype)
+            indices = indices[np.argsort(flat[indices], kind='stable')]
+
+        self.shape = mask.shape
+        self.labels, starts, counts = np.unique(flat[indices], return_index=True, return_counts=True)
+        self._indices = indices
+        self._ranges = {label: (start, count) for label, start, count in zip(self.labels.tolist(), starts, counts)}
+
+    def __contains__(self, label):
+        return label in self._ranges
+
+    def count(self, label) -> int:
+        """The number of voxels of ``label``."""
+        return int(self._ranges.get(label, (0, 0))[1])
+
+    def coordinates(self, label) -> np.ndarray:
+        """Returns an array of shape ``(count(label), mask.ndim)`` with the coordinates of the voxels of ``label``."""
+        start, count = self._ranges.get(label, (0, 0))
+        return np.stack(np.unravel_index(self._indices[start:start + count], self.shape), -1)
+
+    def sample(self, label=None, random_state: np.random.RandomState = None) -> np.ndarray:
+        """
+        Returns the coordinates of a random voxel of ``label``.
+        If ``label`` is None - the label itself is chosen uniformly among the indexed ones,
+        which gives class-balanced sampling.
+        If ``random_state`` is None - `get_random_state` is used, so the sampling is reproducible
+        inside an `Infinite` with a ``random_state``.
+        """
+        if random_state is None:
+            # avoid a circular import
+            from dpipe.batch_iter.seeding import get_random_state
+            random_state = get_random_state()
+        if label is None:
+            if not len(self.labels):
+                raise ValueError('The index is empty.')
+            label = self.labels[random_state.randint(len(self.labels))]
+        if label not in self._ranges:
+            raise ValueError(f'The label {label} is not present in the index.')
+
+        start, count = self._ranges[label]
+        return np.array(np.unravel_index(self._indices[start + random_state.randint(count)], self.shape))
+
+    def distribution(self, patch_size: AxesLike, label=None, random_state: np.random.RandomState = None) -> Callable:
+        """
+        Returns a ``distribution`` for `get_random_patch` that places the centre of the patch
+        at a random voxel of ``label``. The patch is shifted, if necessary, to fit inside the array.
+
+        Only the trailing coordinates, that correspond to the ``axes`` of `get_random_patch`, are used,
+        so that a scalar ``patch_size`` places the patch along the last axis only, just like `get_random_patch` does.
+        """
+
+        def distribution(shape):
+            assert len(shape) <= len(self.shape), (shape, self.shape)
+            centre = self.sample(label, random_state)[len(self.shape) - len(shape):]
+            size = np.broadcast_to(patch_size, len(shape))
+            return np.clip(centre - size // 2, 0, np.asarray(shape) - 1)
+
+        return distribution
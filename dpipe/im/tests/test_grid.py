@@ -1,8 +1,11 @@
+import tempfile
 import unittest
+from pathlib import Path
 
 import numpy as np
 
-from dpipe.im.grid import get_boxes, combine, divide
+from dpipe.im.grid import get_boxes, get_boxes_table, combine, divide, divide_view, gaussian_window, linear_window, \
+    GridAccumulator
 
 
 class TestGrid(unittest.TestCase):
@@ -17,6 +20,18 @@ class TestGrid(unittest.TestCase):
         x_parts = list(divide(x, self.patch_size, self.stride))
         self.assertEqual(len(x_parts), np.prod((1, 5, 7, 9)))
 
+    def test_divide_view(self):
+        x = np.random.randn(*self.x_shape)
+        for axes in [None, [1, 2, 3], [-1, -3, -2]]:
+            with self.subTest(axes=axes):
+                view = divide_view(x, self.spatial_patch_size, self.stride[1:], axes)
+                self.assertEqual(view.shape, (5, 7, 9, *self.x_shape[:1], *self.spatial_patch_size))
+                self.assertFalse(view.flags.writeable)
+                self.assertTrue(np.shares_memory(view, x))
+
+                patches = list(divide(x, self.spatial_patch_size, self.stride[1:], axes, valid=True))
+                np.testing.assert_equal(view.reshape(-1, *patches[0].shape), np.stack(patches))
+
     def test_divide_combine(self):
         result_shape = np.array((3, 40, 56, 72))
         slices = tuple([slice(None)] + [slice(1, -1)] * 3)
@@ -36,6 +51,20 @@ class TestGrid(unittest.TestCase):
         self.assertTrue((stop <= shape).all())
         self.assertTrue((start + box_size == stop).all())
 
+    def test_get_boxes_table(self):
+        shape = (3, 42, 58, 74)
+        table = get_boxes_table(shape, [10] * 3, [8] * 3, valid=False)
+
+        self.assertEqual(table.shape, (np.prod((1, 5, 7, 9)), 2, 4))
+        self.assertIs(table, get_boxes_table(shape, 10, 8, axes=[1, 2, 3], valid=False))
+        self.assertFalse(table.flags.writeable)
+        np.testing.assert_equal(table, np.stack(list(get_boxes(shape, [10] * 3, [8] * 3, valid=False))))
+
+        start, stop = table[:, 0], table[:, 1]
+        self.assertTrue((start[:, 1:] % 8 == 0).all())
+        self.assertTrue((stop <= shape).all())
+        self.assertTrue((stop[:, 0] == 3).all())
+
     def test_combine_int(self):
         patch_size = np.array([20] * 3, int)
         stride = patch_size // 2
@@ -51,3 +80,53 @@ class TestGrid(unittest.TestCase):
             with self.subTest(shape=shape):
                 x = np.random.randn(1, *shape)
                 np.testing.assert_array_almost_equal(x, combine(divide(x, patch_size, stride), shape, stride))
+
+    def test_combine_window(self):
+        patch_size = np.array([20] * 3, int)
+        shape = [45, 43, 48]
+        x = np.random.randn(2, *shape)
+
+        for window in [gaussian_window, linear_window]:
+            for stride in [patch_size // 2, patch_size // 3, patch_size]:
+                with self.subTest(window=window.__name__, stride=stride):
+                    np.testing.assert_array_almost_equal(
+                        x, combine(divide(x, patch_size, stride), shape, stride, window=window))
+
+    def test_combine_dtype(self):
+        patch_size = stride = np.array([10] * 2, int)
+        x = np.random.randn(25, 32)
+
+        result = combine(divide(x, patch_size, stride), x.shape, stride, dtype=np.float32)
+        self.assertEqual(result.dtype, np.float32)
+        np.testing.assert_array_almost_equal(x, result, decimal=5)
+
+        with self.assertRaises(ValueError):
+            combine(divide(x, patch_size, stride), x.shape, stride, dtype=int)
+
+    def test_accumulator(self):
+        patch_size, stride = np.array([10] * 3), np.array([7] * 3)
+        x = np.random.randn(2, 25, 31, 22)
+        patches = list(divide(x, patch_size, stride))
+        order = np.random.permutation(len(patches))
+
+        with tempfile.TemporaryDirectory() as folder:
+            out = np.memmap(Path(folder) / 'out.dat', np.float32, 'w+', shape=x.shape)
+            for kwargs in [{}, dict(window=gaussian_window), dict(out=out)]:
+                with self.subTest(**kwargs):
+                    accumulator = GridAccumulator(x.shape, patch_size, stride, **kwargs)
+                    self.assertEqual(len(accumulator), len(patches))
+                    for index in order[:-1]:
+                        accumulator.add(index, patches[index])
+
+                    with self.assertRaises(ValueError):
+                        accumulator.add(order[0], patches[order[0]])
+                    with self.assertRaises(ValueError):
+                        accumulator.finalize()
+
+                    accumulator.add(order[-1], patches[order[-1]])
+                    np.testing.assert_array_almost_equal(x, accumulator.finalize(), decimal=5)
+
+                    with self.assertRaises(RuntimeError):
+                        accumulator.finalize()
+
+            del out
@@ -3,7 +3,10 @@ import unittest
 import numpy as np
 import pytest
 
-from dpipe.im.patch import sample_box_center_uniformly, get_random_patch, get_random_box
+from dpipe.im.patch import (
+    sample_box_center_uniformly, get_random_patch, get_random_box, LabelIndex, extract_patches, get_random_patches
+)
+from dpipe.im.axes import expand_axes
 from dpipe.im.box import make_box_, get_centered_box
 from dpipe.im.shape_ops import crop_to_box
 from dpipe.im.utils import get_random_tuple
@@ -88,3 +91,91 @@ class TestRandomPatch(unittest.TestCase):
 
         with pytest.raises(ValueError):
             get_random_box([3], [4])
+
+
+class TestLabelIndex(unittest.TestCase):
+    def setUp(self):
+        self.mask = np.random.RandomState(0).choice(3, size=(5, 6, 7), p=[.9, .08, .02])
+
+    def test_coordinates(self):
+        for labels in [None, [1, 2]]:
+            index = LabelIndex(self.mask, labels)
+            for label in [1, 2]:
+                np.testing.assert_array_equal(index.coordinates(label), np.argwhere(self.mask == label))
+                assert index.count(label) == (self.mask == label).sum()
+
+        assert 0 in LabelIndex(self.mask)
+        assert 0 not in LabelIndex(self.mask, [1, 2])
+
+    def test_sample(self):
+        index = LabelIndex(self.mask, [1, 2])
+        random_state = np.random.RandomState(0)
+        for _ in range(100):
+            assert self.mask[tuple(index.sample(2, random_state))] == 2
+            assert self.mask[tuple(index.sample(random_state=random_state))] in [1, 2]
+
+        with pytest.raises(ValueError):
+            index.sample(0)
+
+    def test_distribution(self):
+        index = LabelIndex(self.mask > 0)
+        x = np.arange(self.mask.size).reshape(self.mask.shape)
+        for _ in range(100):
+            patch, segm = get_random_patch(
+                x, self.mask, patch_size=[3, 3, 3], distribution=index.distribution([3, 3, 3], True))
+            assert patch.shape == segm.shape == (3, 3, 3)
+            assert segm.any()
+
+            # a scalar patch size only affects the last axis
+            patch, segm = get_random_patch(x, self.mask, patch_size=3, distribution=index.distribution(3, True))
+            assert patch.shape == segm.shape == (*self.mask.shape[:-1], 3)
+            assert segm.any()
+
+
+class TestExtractPatches(unittest.TestCase):
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+        self.x = self.random_state.randn(2, 10, 11, 12)
+
+    def get_expected(self, arrays, starts, patch_size, axes):
+        return np.stack([
+            crop_to_box(x, np.array([start, start + patch_size]), axes) for x, start in zip(arrays, starts)
+        ])
+
+    def test_single(self):
+        for axes, patch_size in [(None, [3, 4, 5]), ([1, 3], [5, 2]), ([-1], [7]), ([0, 2], [1, 3])]:
+            axes = expand_axes(axes, patch_size)
+            patch_size = np.array(patch_size)
+            limits = np.array(self.x.shape)[list(axes)] - patch_size + 1
+            starts = self.random_state.randint(limits, size=(20, len(axes)))
+
+            np.testing.assert_array_equal(
+                extract_patches(self.x, starts, patch_size, axes),
+                self.get_expected([self.x] * len(starts), starts, patch_size, axes)
+            )
+
+    def test_many(self):
+        arrays = [self.x, -self.x, 2 * self.x]
+        indices = [2, 0, 0, 1, 2]
+        starts = self.random_state.randint(5, size=(len(indices), 3))
+        out = np.zeros((len(indices), 2, 3, 3, 3))
+
+        result = extract_patches(arrays, starts, 3, indices=indices, out=out)
+        assert result is out
+        np.testing.assert_array_equal(
+            out, self.get_expected([arrays[i] for i in indices], starts, np.array([3, 3, 3]), (-3, -2, -1)))
+
+    def test_raises(self):
+        with pytest.raises(ValueError):
+            extract_patches(self.x, [[0, 0, 10]], 3)
+        with pytest.raises(ValueError):
+            extract_patches(self.x, [[-1, 0, 0]], 3)
+        with pytest.raises(ValueError):
+            extract_patches(self.x, [[0, 0, 0]], 3, out=np.zeros((1, 3, 3, 3)))
+
+    def test_get_random_patches(self):
+        y = self.x[0] > 0
+        patches, masks = get_random_patches(self.x, y, patch_size=[4, 5], axes=[-2, -1], n_patches=7)
+        assert patches.shape == (7, 2, 10, 4, 5)
+        assert masks.shape == (7, 10, 4, 5)
+        np.testing.assert_array_equal(masks, patches[:, 0] > 0)
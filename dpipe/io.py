@@ -7,12 +7,17 @@ where ``kwargs`` are loader-specific keyword arguments.
 Similarly, all the saving functions have the interface ``save(value, path, **kwargs)``.
 """
 import argparse
+import itertools
 import json
 import pickle
 import re
 import os
+import shutil
+import struct
+import uuid
+import zlib
 from pathlib import Path
-from typing import Union, Callable
+from typing import Union, Callable, Sequence
 
 import numpy as np
 import pandas as pd
@@ -23,6 +28,8 @@ __all__ = [
     'load_json', 'save_json',
     'load_pickle', 'save_pickle',
     'load_numpy', 'save_numpy',
+    'load_chunked', 'save_chunked', 'ChunkedArray',
+    'load_compressed', 'save_compressed',
 ]
 
 PathLike = Union[Path, str]
@@ -74,12 +81,16 @@ def load(path: PathLike, **kwargs):
     ``kwargs`` are format-specific keyword arguments.
 
     The following extensions are supported:
-        npy, tif, hdr, img, nii, nii.gz, json, mhd, csv, txt, pickle, pkl
+        npy, npc, tif, hdr, img, nii, nii.gz, json, mhd, csv, txt, pickle, pkl, chunks
     """
     name = Path(path).name
 
     if name.endswith('.npy'):
         return load_numpy(path, **kwargs)
+    if name.endswith('.chunks'):
+        return load_chunked(path, **kwargs)
+    if name.endswith('.npc'):
+        return load_compressed(path, **kwargs)
     if name.endswith(('.nii', '.nii.gz', '.hdr', '.img')):
         import nibabel as nib
         return nib.load(path, **kwargs).get_data()
@@ -108,12 +119,16 @@ def save(value, path: PathLike, **kwargs):
     ``kwargs`` are format-specific keyword arguments.
 
     The following extensions are supported:
-        npy, tif, hdr, img, nii, nii.gz, json, txt, pickle, pkl
+        npy, npc, tif, hdr, img, nii, nii.gz, json, txt, pickle, pkl, chunks
     """
     name = Path(path).name
 
     if name.endswith('.npy'):
         save_numpy(value, path, **kwargs)
+    elif name.endswith('.chunks'):
+        save_chunked(value, path, **kwargs)
+    elif name.endswith('.npc'):
+        save_compressed(value, path, **kwargs)
     elif name.endswith(('.nii', '.nii.gz', '.hdr', '.img')):
         import nibabel as nib
         nib.save(value, path, **kwargs)
@@ -158,8 +173,19 @@ def save_numpy(value, path: PathLike, *, allow_pickle: bool = True, fix_imports:
     np.save(path, value, allow_pickle=allow_pickle, fix_imports=fix_imports)
 
 
-def load_numpy(path: PathLike, *, allow_pickle: bool = True, fix_imports: bool = True):
-    """A wrapper around ``np.load`` with ``allow_pickle`` set to True by default."""
+def load_numpy(path: PathLike, *, allow_pickle: bool = True, fix_imports: bool = True, mmap_mode: str = None):
+    """
+    A wrapper around ``np.load`` with ``allow_pickle`` set to True by default.
+    If ``mmap_mode`` is not None, the array is memory-mapped, e.g. ``mmap_mode='r'`` opens it for reading.
+    Arrays of python objects can't be memory-mapped, so they are loaded fully.
+    """
+    if mmap_mode is not None:
+        try:
+            return np.load(path, allow_pickle=allow_pickle, fix_imports=fix_imports, mmap_mode=mmap_mode)
+        except ValueError:
+            # "Array can't be memory-mapped: Python objects in dtype."
+            pass
+
     return np.load(path, allow_pickle=allow_pickle, fix_imports=fix_imports)
 
 
@@ -175,6 +201,263 @@ def load_pickle(path: PathLike):
         return pickle.load(file)
 
 
+def _get_codecs():
+    codecs = {'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress)}
+    try:
+        import zstandard
+        # the (de)compressors are not thread-safe
+        codecs['zstd'] = (lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+                          lambda data: zstandard.ZstdDecompressor().decompress(data))
+    except ImportError:
+        pass
+    try:
+        import lz4.frame
+        codecs['lz4'] = lz4.frame.compress, lz4.frame.decompress
+    except ImportError:
+        pass
+    return codecs
+
+
+_CODECS = _get_codecs()
+_COMPRESSED_MAGIC = b'\x93DPIPE-NPC'
+
+
+def _get_default_filters(dtype: np.dtype):
+    """Returns the codec, and whether to apply the delta and the shuffle filters to an array of type ``dtype``."""
+    # the neighbouring integers, e.g. in CT images or masks, are close, so their differences compress well
+    if dtype.kind in 'biu':
+        codec = next(name for name in ['zstd', 'lz4', 'zlib'] if name in _CODECS)
+        return codec, True, dtype.itemsize > 1
+    # the floats are poorly compressible, so the fastest codec is preferred
+    codec = next(name for name in ['lz4', 'zstd', 'zlib'] if name in _CODECS)
+    return codec, False, dtype.itemsize > 1
+
+
+def save_compressed(value, path: PathLike, *, codec: str = None, delta: bool = None, shuffle: bool = None):
+    """
+    Save a numpy array to ``path`` in a compressed format.
+
+    Parameters
+    ----------
+    value
+    path
+    codec: str, None, optional
+        the compression codec: ``'zlib'``, ``'zstd'`` (requires ``zstandard``) or ``'lz4'`` (requires ``lz4``).
+        If None - the fastest available codec is chosen based on ``value.dtype``.
+    delta: bool, None, optional
+        whether to store the differences between the neighbouring elements. Only integer arrays are supported.
+        If None - it is applied to integer and boolean arrays.
+    shuffle: bool, None, optional
+        whether to group the bytes by their significance, which makes them more compressible.
+        If None - it is applied to multi-byte types.
+    """
+    value = np.ascontiguousarray(value)
+    if value.dtype.hasobject:
+        raise TypeError('Arrays of objects are not supported.')
+
+    default_codec, default_delta, default_shuffle = _get_default_filters(value.dtype)
+    codec = default_codec if codec is None else codec
+    delta = default_delta if delta is None else delta
+    shuffle = default_shuffle if shuffle is None else shuffle
+    if codec not in _CODECS:
+        raise ValueError(f'The codec "{codec}" is not available. Available codecs: {", ".join(_CODECS)}.')
+    if delta and value.dtype.kind not in 'biu':
+        raise ValueError(f'The delta filter is only supported for integer arrays, not {value.dtype}.')
+
+    data = value.ravel()
+    if delta:
+        # the arithmetic of unsigned integers wraps around, so the filter is lossless
+        data = data.view(f'u{value.dtype.itemsize}')
+        data = np.diff(data, prepend=data.dtype.type(0))
+    data = data.view(np.uint8)
+    if shuffle:
+        data = data.reshape(-1, value.dtype.itemsize).T
+    data = _CODECS[codec][0](np.ascontiguousarray(data).tobytes())
+
+    header = json.dumps({
+        'shape': value.shape, 'dtype': value.dtype.str, 'codec': codec, 'delta': delta, 'shuffle': shuffle,
+    }).encode()
+    with open(path, 'wb') as file:
+        file.write(_COMPRESSED_MAGIC)
+        file.write(struct.pack('<I', len(header)))
+        file.write(header)
+        file.write(data)
+
+
+def load_compressed(path: PathLike) -> np.ndarray:
+    """Load a numpy array saved by `save_compressed`."""
+    with open(path, 'rb') as file:
+        if file.read(len(_COMPRESSED_MAGIC)) != _COMPRESSED_MAGIC:
+            raise ValueError(f'"{path}" is not a compressed numpy file.')
+        size, = struct.unpack('<I', file.read(4))
+        header = json.loads(file.read(size))
+        data = file.read()
+
+    codec, dtype = header['codec'], np.dtype(header['dtype'])
+    if codec not in _CODECS:
+        raise ValueError(f'The codec "{codec}" required to read "{path}" is not available.')
+
+    data = np.frombuffer(_CODECS[codec][1](data), np.uint8)
+    if header['shuffle']:
+        data = data.reshape(dtype.itemsize, -1).T
+    data = np.ascontiguousarray(data)
+    if header['delta']:
+        data = data.view(f'u{dtype.itemsize}').cumsum(dtype=f'u{dtype.itemsize}')
+    return data.view(dtype).reshape(header['shape'])
+
+
+class ChunkedArray:
+    """
+    A read-only array stored on disk as a folder of equally sized chunks.
+
+    Indexing with integers and slices reads only the chunks that intersect the requested region,
+    so functions like `crop_to_box` or `get_random_patch` can be applied directly to large volumes.
+    Any other kind of indexing loads the whole array. Use `save_chunked` to create one.
+    """
+
+    def __init__(self, path: PathLike):
+        self.path = Path(path)
+        meta = load_json(self.path / 'meta.json')
+        self.shape = tuple(meta['shape'])
+        self.chunks = tuple(meta['chunks'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.fill_value = meta['fill_value']
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f'{type(self).__name__}(shape={self.shape}, dtype={self.dtype}, chunks={self.chunks})'
+
+    def __array__(self, dtype=None, copy=None):
+        value = self._read_box((0,) * self.ndim, self.shape)
+        return value if dtype is None else value.astype(dtype, copy=False)
+
+    def _read_chunk(self, index: Sequence[int]):
+        try:
+            return np.load(self.path / f'{".".join(map(str, index))}.npy')
+        except FileNotFoundError:
+            return None
+
+    def _read_box(self, start: Sequence[int], stop: Sequence[int]) -> np.ndarray:
+        result = np.full(np.subtract(stop, start), self.fill_value, self.dtype)
+        if not result.size:
+            return result
+
+        ranges = [range(lo // size, (hi - 1) // size + 1) for lo, hi, size in zip(start, stop, self.chunks)]
+        for index in itertools.product(*ranges):
+            chunk = self._read_chunk(index)
+            # the empty chunks are not stored
+            if chunk is None:
+                continue
+
+            chunk_start = np.multiply(index, self.chunks)
+            lo, hi = np.maximum(start, chunk_start), np.minimum(stop, chunk_start + chunk.shape)
+            target = tuple(map(slice, lo - start, hi - start))
+            result[target] = chunk[tuple(map(slice, lo - chunk_start, hi - chunk_start))]
+        return result
+
+    @staticmethod
+    def _get_bounds(key, n: int):
+        """Returns the bounds along a single axis, and the index to apply to the region within those bounds."""
+        if isinstance(key, slice):
+            indices = range(*key.indices(n))
+            if not indices:
+                return 0, 0, slice(None)
+
+            lo, hi = min(indices), max(indices) + 1
+            end = indices[-1] - lo + (1 if indices.step > 0 else -1)
+            return lo, hi, slice(indices[0] - lo, end if end >= 0 else None, indices.step)
+
+        if not -n <= key < n:
+            raise IndexError(f'Index {key} is out of bounds for axis with size {n}.')
+        key = key % n
+        return key, key + 1, 0
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = key,
+        if not all(k is Ellipsis or isinstance(k, (int, np.integer, slice)) and not isinstance(k, bool) for k in key):
+            return np.asarray(self)[key]
+
+        ellipsis = [i for i, k in enumerate(key) if k is Ellipsis]
+        if len(ellipsis) > 1:
+            raise IndexError('An index can only have a single ellipsis.')
+        if ellipsis:
+            position, = ellipsis
+            key = key[:position] + (slice(None),) * (self.ndim - len(key) + 1) + key[position + 1:]
+        if len(key) > self.ndim:
+            raise IndexError(f'Too many indices for an array with {self.ndim} dimensions.')
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        # read the bounding box of the requested region, then index it locally
+        start, stop, local = zip(*map(self._get_bounds, key, self.shape)) if key else ((), (), ())
+        return self._read_box(start, stop)[local]
+
+
+def save_chunked(value: np.ndarray, path: PathLike, *, chunks: Union[int, Sequence[int]] = 64, fill_value=0):
+    """
+    Save ``value`` to the folder ``path`` split into chunks of shape ``chunks``.
+    The chunks that contain only ``fill_value`` are not stored.
+    """
+    value = np.asarray(value)
+    if value.dtype.hasobject:
+        raise TypeError('Arrays of objects are not supported.')
+    chunks = np.broadcast_to(chunks, value.ndim).astype(int)
+    if (chunks <= 0).any():
+        raise ValueError(f'The chunk sizes must be positive: {chunks}.')
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # the array is written to a temporary folder first, so that an incomplete array can't be loaded
+    temp = path.with_name(f'.temp_{uuid.uuid4().hex}_{path.name}')
+    temp.mkdir()
+    try:
+        for index in itertools.product(*(range(-(-n // size)) for n, size in zip(value.shape, chunks))):
+            chunk = value[tuple(slice(i * size, (i + 1) * size) for i, size in zip(index, chunks))]
+            if (chunk != fill_value).any():
+                np.save(temp / f'{".".join(map(str, index))}.npy', chunk, allow_pickle=False)
+
+        save_json({
+            'shape': value.shape, 'chunks': chunks, 'dtype': value.dtype.str,
+            'fill_value': np.asarray(fill_value).item(),
+        }, temp / 'meta.json')
+
+        # a non-empty folder can't be replaced, so the previous array is moved away first
+        if path.exists():
+            old = path.with_name(f'.old_{uuid.uuid4().hex}_{path.name}')
+            try:
+                os.rename(path, old)
+            except FileNotFoundError:
+                pass
+            else:
+                shutil.rmtree(old)
+
+        try:
+            os.rename(temp, path)
+        except OSError:
+            # another process has just saved the same array
+            if not (path / 'meta.json').exists():
+                raise
+
+    finally:
+        if temp.exists():
+            shutil.rmtree(temp)
+
+
+def load_chunked(path: PathLike) -> ChunkedArray:
+    """Open an array stored by `save_chunked`. The data is read lazily."""
+    return ChunkedArray(path)
+
+
 def load_or_create(path: PathLike, create: Callable, *args,
                    save: Callable = save, load: Callable = load, **kwargs):
     """
@@ -1,3 +1,6 @@
+import os
+from collections import deque
+from concurrent.futures import Executor
 from contextlib import suppress
 from functools import wraps
 from itertools import chain
@@ -187,6 +190,41 @@ def make_chunks(iterable: Iterable, chunk_size: int, incomplete: bool = True):
         yield chunk
 
 
+def executor_map(executor: Executor, func: Callable, iterable: Iterable, buffer_size: int = None) -> Iterable:
+    """
+    A lazy version of ``executor.map(func, iterable)``: at most ``buffer_size`` values from ``iterable``
+    are submitted to the ``executor`` at the same time. The results are yielded in the same order as the values.
+
+    Consuming the iterable, computing ``func`` and processing the results overlap in time, while the memory
+    consumption is bounded by ``buffer_size``. If ``buffer_size`` is None - ``2 * os.cpu_count()`` is used.
+
+    Examples
+    --------
+    >>> from concurrent.futures import ThreadPoolExecutor
+    >>> with ThreadPoolExecutor(4) as executor:
+    >>>     list(executor_map(executor, np.square, [1, 2, 3]))
+    [1, 4, 9]
+    """
+    if buffer_size is None:
+        buffer_size = 2 * os.cpu_count()
+    if buffer_size <= 0:
+        raise ValueError(f'`buffer_size` must be greater than zero, not {buffer_size}.')
+
+    futures = deque()
+    try:
+        for value in iterable:
+            if len(futures) == buffer_size:
+                yield futures.popleft().result()
+            futures.append(executor.submit(func, value))
+
+        while futures:
+            yield futures.popleft().result()
+
+    finally:
+        for future in futures:
+            future.cancel()
+
+
 def collect(func: Callable):
     """
     Make a function that returns a list from a function that returns an iterator.
@@ -2,11 +2,15 @@
 Various functions that can be used to build predictors.
 """
 from functools import partial
-from typing import Callable
+from itertools import combinations
+from typing import Callable, Sequence
 
 import numpy as np
 
-__all__ = 'chain_decorators', 'preprocess', 'postprocess'
+from dpipe.im.axes import AxesLike, check_axes
+from dpipe.itertools import zip_equal
+
+__all__ = 'chain_decorators', 'preprocess', 'postprocess', 'tta', 'flips'
 
 
 def chain_decorators(*decorators: Callable, predict: Callable, **kwargs):
@@ -82,3 +86,62 @@ def postprocess(func, *args, **kwargs):
         return wrapper
 
     return decorator
+
+
+def flips(axes: AxesLike) -> list:
+    """
+    Returns all the ``2 ** len(axes)`` combinations of flips along the ``axes``, including the identity.
+    Each flip is its own inverse.
+
+    Examples
+    --------
+    >>> @tta(flips([-3, -2, -1]))
+    >>> def predict(batch):
+    >>>     return model.do_inf_step(batch)
+    performs 8-fold flip augmentation of each batch of 3D images.
+    """
+    axes = check_axes(axes)
+    return [partial(np.flip, axis=subset) for n in range(len(axes) + 1) for subset in combinations(axes, n)]
+
+
+def tta(transforms: Sequence[Callable], inverse: Sequence[Callable] = None):
+    """
+    Test-time augmentation: averages the predictions made for several ``transforms`` of an incoming batch.
+
+    The transformed copies of the whole batch are concatenated along the first axis and passed to ``predict``
+    in a single call. Then ``inverse`` transforms are applied to the corresponding parts of the prediction.
+
+    Parameters
+    ----------
+    transforms: Sequence[Callable(batch)]
+        the transformations to apply. Must preserve the batch's shape.
+    inverse: Sequence[Callable(batch)], None, optional
+        the transformations that undo ``transforms``. If None - ``transforms`` are assumed to be their own inverse,
+        e.g. `flips`.
+
+    Notes
+    -----
+    ``predict`` receives ``len(transforms)`` times more objects, so the batch size must be chosen accordingly.
+    This decorator can be combined with the ``batch_size`` argument of `patches_grid`.
+
+    References
+    ----------
+    `flips`, `patches_grid`
+    """
+    if inverse is None:
+        inverse = transforms
+    transforms, inverse = zip(*zip_equal(transforms, inverse))
+
+    def decorator(predict):
+        def wrapper(x):
+            size = len(x)
+            prediction = predict(np.concatenate([transform(x) for transform in transforms]))
+
+            result = 0
+            for i, undo in enumerate(inverse):
+                result = result + undo(prediction[i * size:(i + 1) * size])
+            return result / len(transforms)
+
+        return wrapper
+
+    return decorator
@@ -1,14 +1,15 @@
-from typing import Union, Callable
+from concurrent.futures import Executor
+from typing import Union, Callable, Iterable
 
 import numpy as np
 
 from dpipe.im.axes import broadcast_to_axes, AxesLike, AxesParams
 from dpipe.im.grid import divide, combine
-from dpipe.itertools import extract
+from dpipe.itertools import extract, executor_map
 from dpipe.im.shape_ops import pad_to_shape, crop_to_shape, pad_to_divisible
 from dpipe.im.shape_utils import prepend_dims, extract_dims
 
-__all__ = 'add_extract_dims', 'divisible_shape', 'patches_grid'
+__all__ = 'add_extract_dims', 'divisible_shape', 'patches_grid', 'predict_batches'
 
 
 def add_extract_dims(n_add: int = 1, n_extract: int = None):
@@ -68,8 +69,51 @@ def divisible_shape(divisor: AxesLike, axes: AxesLike = None, padding_values: Un
     return decorator
 
 
+def _stack_batches(patches: Iterable[np.ndarray], batch_size: int) -> Iterable[np.ndarray]:
+    if batch_size <= 0:
+        raise ValueError(f'`batch_size` must be greater than zero, not {batch_size}.')
+
+    chunk = []
+    for patch in patches:
+        if chunk and (len(chunk) == batch_size or patch.shape != chunk[0].shape):
+            yield np.stack(chunk)
+            chunk = []
+        chunk.append(patch)
+
+    if chunk:
+        yield np.stack(chunk)
+
+
+def predict_batches(predict: Callable, patches: Iterable[np.ndarray], batch_size: int,
+                    executor: Executor = None, buffer_size: int = None) -> Iterable[np.ndarray]:
+    """
+    Stack ``patches`` into batches of size ``batch_size``, apply ``predict`` to each batch
+    and yield the predictions for individual patches.
+
+    Consecutive patches of different shapes are never stacked together, so some batches may be smaller
+    than ``batch_size``.
+
+    If ``executor`` is None - only a single batch is kept in memory at a time. Otherwise the batches are
+    predicted in parallel, with at most ``buffer_size`` batches (and their predictions) in memory at a time,
+    ``2 * os.cpu_count()`` by default. The predictions are still yielded in the original order.
+
+    References
+    ----------
+    `executor_map`
+    """
+    batches = _stack_batches(patches, batch_size)
+    if executor is None:
+        predictions = map(predict, batches)
+    else:
+        predictions = executor_map(executor, predict, batches, buffer_size)
+
+    for prediction in predictions:
+        yield from prediction
+
+
 def patches_grid(patch_size: AxesLike, stride: AxesLike, axes: AxesLike = None,
-                 padding_values: Union[AxesParams, Callable] = 0, ratio: AxesParams = 0.5):
+                 padding_values: Union[AxesParams, Callable] = 0, ratio: AxesParams = 0.5, batch_size: int = None,
+                 executor: Executor = None, buffer_size: int = None):
     """
     Divide an incoming array into patches of corresponding ``patch_size`` and ``stride`` and then combine
     predicted patches by averaging the overlapping regions.
@@ -77,9 +121,18 @@ def patches_grid(patch_size: AxesLike, stride: AxesLike, axes: AxesLike = None,
     If ``padding_values`` is not None, the array will be padded to an appropriate shape to make a valid division.
     Afterwards the padding is removed.
 
+    If ``batch_size`` is not None, the patches are stacked into batches of (at most) ``batch_size`` patches,
+    and ``predict`` receives a whole batch at once and must return a prediction for each of its patches.
+
+    If ``executor`` is not None (e.g. a `concurrent.futures.ThreadPoolExecutor`) - the patches (or batches)
+    are predicted in parallel, while the next ones are being extracted and the previous ones are being combined.
+    At most ``buffer_size`` patches (or batches) are in flight at the same time. The predictions are combined
+    in the original order, so the result is deterministic. Note that a process pool requires ``predict``
+    to be picklable.
+
     References
     ----------
-    `grid.divide`, `grid.combine`, `pad_to_shape`
+    `grid.divide`, `grid.combine`, `pad_to_shape`, `predict_batches`, `executor_map`
     """
     axes, patch_size, stride = broadcast_to_axes(axes, patch_size, stride)
     valid = padding_values is not None
@@ -92,7 +145,13 @@ def patches_grid(patch_size: AxesLike, stride: AxesLike, axes: AxesLike = None,
                 new_shape = padded_shape + (stride - padded_shape + patch_size) % stride
                 x = pad_to_shape(x, new_shape, axes, padding_values, ratio)
 
-            patches = map(predict, divide(x, patch_size, stride, axes))
+            patches = divide(x, patch_size, stride, axes)
+            if batch_size is not None:
+                patches = predict_batches(predict, patches, batch_size, executor, buffer_size)
+            elif executor is not None:
+                patches = executor_map(executor, predict, patches, buffer_size)
+            else:
+                patches = map(predict, patches)
             prediction = combine(patches, extract(x.shape, axes), stride, axes)
 
             if valid:
@@ -1,3 +1,5 @@
+import numpy as np
+
 from dpipe.predict.functional import *
 
 
@@ -23,3 +25,23 @@ def test_chain_decorators():
     )
 
     assert f() == chained()
+
+
+def test_tta():
+    calls = []
+
+    def predict(batch):
+        calls.append(len(batch))
+        # a prediction that depends on the orientation
+        return batch * np.arange(batch.shape[-1])
+
+    x = np.random.randn(2, 5, 6, 7)
+    transforms = flips([-2, -1])
+    assert len(transforms) == 4
+
+    result = tta(transforms)(predict)(x)
+    assert calls == [8]
+    np.testing.assert_array_almost_equal(result, x * (x.shape[-1] - 1) / 2)
+
+    identity = tta([lambda y: y * 2], [lambda y: y / 2])(predict)(x)
+    np.testing.assert_array_almost_equal(identity, predict(x))
@@ -1,3 +1,5 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 import numpy as np
 
@@ -31,3 +33,23 @@ def test_divisible_patches():
     for shape in [(373, 302, 55), (330, 252, 67)]:
         x = np.random.randn(*shape)
         check_equal(patch_size=size, stride=stride)
+
+
+def test_patches_grid_batches():
+    def predict(batch):
+        assert batch.ndim == 5 and len(batch) <= 4
+        return batch
+
+    x = np.random.randn(3, 23, 20, 27) * 10
+    for stride, padding_values in [(1, 0), (10, None), (7, 0)]:
+        assert_eq(x, patches_grid(10, stride, padding_values=padding_values, batch_size=4)(predict)(x))
+
+    with pytest.raises(ValueError):
+        patches_grid(10, 10, batch_size=0)(predict)(x)
+
+
+def test_patches_grid_executor():
+    x = np.random.randn(3, 23, 20, 27) * 10
+    with ThreadPoolExecutor(4) as executor:
+        for batch_size in [None, 3]:
+            assert_eq(x, patches_grid(10, 7, executor=executor, batch_size=batch_size, buffer_size=2)(identity)(x))
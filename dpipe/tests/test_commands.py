@@ -0,0 +1,39 @@
+import threading
+
+import numpy as np
+
+from dpipe.commands import stream_from_folder, load_from_folder, evaluate_individual_metrics
+from dpipe.io import save_numpy, load_json
+
+
+def test_stream_from_folder(tmpdir):
+    for i in range(20):
+        save_numpy(np.full(3, i), str(tmpdir / f'{i}.npy'))
+
+    loaded, lock = [], threading.Lock()
+
+    def loader(path):
+        with lock:
+            loaded.append(path)
+        return np.load(path)
+
+    stream = stream_from_folder(tmpdir, loader, n_workers=2, prefetch=3)
+    first = next(stream)
+    # only the prefetch window is loaded
+    assert len(loaded) <= 4
+
+    pairs = [first, *stream]
+    expected = load_from_folder(tmpdir)
+    assert [i for i, _ in pairs] == [i for i, _ in expected]
+    for (_, x), (_, y) in zip(pairs, expected):
+        np.testing.assert_array_equal(x, y)
+
+
+def test_evaluate_individual_metrics(tmpdir):
+    predictions = tmpdir.mkdir('predictions')
+    for i in range(5):
+        save_numpy(np.full(3, i), str(predictions / f'{i}.npy'))
+
+    evaluate_individual_metrics(lambda i: np.full(3, int(i)), {'eq': lambda x, y: bool((x == y).all())},
+                                predictions, tmpdir / 'results', n_workers=3)
+    assert load_json(tmpdir / 'results' / 'eq.json') == {str(i): True for i in range(5)}
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+import dpipe.io
+from dpipe.io import save_chunked, load_chunked, load, save, ChunkedArray, save_compressed
+from dpipe.im.patch import get_random_patch
+
+
+def test_chunked(tmpdir):
+    x = np.random.randn(13, 7, 20)
+    x[:5] = 0
+    path = tmpdir / 'x.chunks'
+    save(x, path, chunks=[5, 4, 3])
+    # the empty chunks are not stored
+    assert len(path.listdir()) == 2 * 2 * 7 + 1
+
+    chunked = load(path)
+    assert isinstance(chunked, ChunkedArray)
+    assert chunked.shape == x.shape and chunked.dtype == x.dtype
+    np.testing.assert_array_equal(chunked, x)
+
+    for key in [0, -1, (slice(3, 9), 2), (..., slice(None, None, -3)), (1, ..., 4), (slice(2, 11, 4), slice(5, 2, -1)),
+                (slice(4, 4),), (2, 3, 4), np.array([1, 2]), (slice(None), [0, 3])]:
+        np.testing.assert_array_equal(chunked[key], x[key])
+
+    with pytest.raises(IndexError):
+        chunked[13]
+    with pytest.raises(IndexError):
+        chunked[0, 0, 0, 0]
+
+    save_chunked(x[:3], path, chunks=2)
+    np.testing.assert_array_equal(load_chunked(path), x[:3])
+
+
+def test_chunked_patch(tmpdir):
+    x = np.random.randint(0, 100, size=(3, 30, 31, 32)).astype(np.int16)
+    save_chunked(x, tmpdir / 'x.chunks', chunks=[3, 8, 8, 8])
+    chunked = load_chunked(tmpdir / 'x.chunks')
+
+    patch = get_random_patch(chunked, patch_size=[10, 10, 10])
+    assert patch.shape == (3, 10, 10, 10)
+    assert patch.dtype == np.int16
+
+
+def test_chunked_interrupted(tmpdir, monkeypatch):
+    x = np.random.randn(10, 10)
+    path = tmpdir / 'x.chunks'
+    save_chunked(x, path, chunks=5)
+
+    def interrupt(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(dpipe.io, 'save_json', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        save_chunked(x + 1, path, chunks=5)
+    monkeypatch.undo()
+
+    # the previous array is intact and no temporary folders are left
+    np.testing.assert_array_equal(load_chunked(path), x)
+    assert tmpdir.listdir() == [path]
+
+
+def test_compressed(tmpdir):
+    random_state = np.random.RandomState(0)
+    arrays = [
+        random_state.randint(-1024, 3000, size=(10, 20, 30)).astype(np.int16),
+        random_state.randint(0, 3, size=(40, 50)).astype(np.uint8),
+        random_state.randn(5, 6).astype('>f8'),
+        random_state.randn(3, 4) > 0,
+        np.zeros((0, 3), np.int64),
+        np.asfortranarray(random_state.randn(7, 8)),
+    ]
+    path = tmpdir / 'x.npc'
+    for x in arrays:
+        for kwargs in [{}, dict(codec='zlib', delta=False, shuffle=False), dict(shuffle=True)]:
+            save(x, path, **kwargs)
+            y = load(path)
+            assert y.dtype == x.dtype
+            np.testing.assert_array_equal(y, x)
+
+    with pytest.raises(ValueError):
+        save_compressed(arrays[2], path, delta=True)
+    with pytest.raises(ValueError):
+        save_compressed(arrays[0], path, codec='unknown')
+
+
+def test_compressed_size(tmpdir):
+    x = np.cumsum(np.random.RandomState(0).randint(-2, 3, size=10 ** 5)).astype(np.int16)
+    save_compressed(x, tmpdir / 'x.npc')
+    assert (tmpdir / 'x.npc').size() < x.nbytes / 3
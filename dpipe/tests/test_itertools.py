@@ -1,9 +1,11 @@
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
 from dpipe.im.utils import filter_mask
-from dpipe.itertools import zip_equal, flatten, extract, negate_indices, head_tail, peek
+from dpipe.itertools import zip_equal, flatten, extract, negate_indices, head_tail, peek, executor_map
 
 
 class TestItertools(unittest.TestCase):
@@ -65,3 +67,24 @@ class TestItertools(unittest.TestCase):
             head, new_it = peek(self.make_iterable(it))
             self.assertEqual(head, it[0])
             self.assertListEqual(list(new_it), it)
+
+    def test_executor_map(self):
+        submitted = []
+
+        def source():
+            for i in range(50):
+                submitted.append(i)
+                yield i
+
+        def slow_square(x):
+            time.sleep(np.random.uniform(0, .005))
+            return x ** 2
+
+        with ThreadPoolExecutor(4) as executor:
+            values = executor_map(executor, slow_square, source(), buffer_size=3)
+            self.assertEqual(next(values), 0)
+            self.assertLessEqual(len(submitted), 4)
+            self.assertListEqual(list(values), [i ** 2 for i in range(1, 50)])
+
+            with self.assertRaises(ValueError):
+                list(executor_map(executor, slow_square, range(5), buffer_size=0))
@@ -7,3 +7,4 @@ from .base import *
 from .checkpoint import *
 from .logging import *
 from .policy import *
+from .validator import BackgroundValidator
@@ -1,11 +1,16 @@
 import contextlib
+import random
+import time
+from itertools import islice
 from typing import Callable
 
 import numpy as np
+import torch
 
 from .checkpoint import Checkpoints
 from .policy import Policy, ValuePolicy, EarlyStopping
 from .logging import Logger
+from .validator import BackgroundValidator
 
 __all__ = 'train',
 
@@ -14,10 +19,20 @@ class _DummyCheckpoints:
     def save(self, iteration: int):
         pass
 
+    def save_partial(self, iteration: int, step: int, progress=None):
+        pass
+
     @staticmethod
     def restore():
         return 0
 
+    def wait(self):
+        pass
+
+    @staticmethod
+    def restore_partial():
+        return 0, None
+
 
 class _DummyLogger(Logger):
     def train(self, train_losses, step):
@@ -32,8 +47,36 @@ def _build_context_manager(o):
     yield o
 
 
+def _get_random_states():
+    states = {'random': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        states['cuda'] = torch.cuda.get_rng_state_all()
+    return states
+
+
+def _set_random_states(states):
+    random.setstate(states['random'])
+    np.random.set_state(states['numpy'])
+    torch.set_rng_state(states['torch'])
+    if 'cuda' in states and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states['cuda'])
+
+
+def _resume_epoch(batches, iterator, step: int):
+    """Skip the first ``step`` batches of the epoch."""
+    if not step:
+        return batches
+
+    batches_per_epoch = getattr(iterator, 'batches_per_epoch', None)
+    # the batches of an infinite iterator don't need to be loaded only to be skipped
+    if batches_per_epoch is not None:
+        return islice(batches, batches_per_epoch - step)
+    return islice(batches, step, None)
+
+
 def train(train_step: Callable, batch_iter: Callable, n_epochs: int = np.inf, logger: Logger = None,
-          checkpoints: Checkpoints = None, validate: Callable = None, **kwargs):
+          checkpoints: Checkpoints = None, validate: Callable = None, checkpoint_steps: int = None,
+          checkpoint_seconds: float = None, **kwargs):
     """
     Performs a series of train and validation steps.
 
@@ -49,11 +92,26 @@ def train(train_step: Callable, batch_iter: Callable, n_epochs: int = np.inf, lo
     checkpoints: Checkpoints, None, optional
     validate: Callable, None, optional
         a function to calculate metrics on the validation set.
+        Use `BackgroundValidator` to overlap the validation with the next epoch.
+    checkpoint_steps: int, None, optional
+        if not None - the ``checkpoints`` are also saved every ``checkpoint_steps`` train steps.
+    checkpoint_seconds: float, None, optional
+        if not None - the ``checkpoints`` are also saved if more than ``checkpoint_seconds`` passed
+        since the previous save.
+        If either ``checkpoint_steps`` or ``checkpoint_seconds`` is not None, ``checkpoints`` must also
+        implement ``save_partial`` and ``restore_partial``, otherwise only ``save`` and ``restore`` are used.
     kwargs
         additional keyword arguments passed to ``train_step``.
         For instances of `ValuePolicy` their `value` attribute is passed.
         Other policies are used for early stopping.
 
+    Notes
+    -----
+    The mid-epoch checkpoints contain the train losses and the random states of ``random``, ``numpy`` and ``torch``.
+    After a restart the interrupted epoch is continued from the next step: the completed steps are not repeated.
+    If ``batch_iter`` has the ``batches_per_epoch`` attribute, like `Infinite`, only the remaining batches
+    are requested. Otherwise the completed batches are skipped.
+
     References
     ----------
     See the :doc:`tutorials/training` tutorial for more details.
@@ -66,6 +124,12 @@ def train(train_step: Callable, batch_iter: Callable, n_epochs: int = np.inf, lo
         for name, policy in policies.items():
             getattr(policy, method.__name__)(*args, **kw)
 
+    def receive_metrics(wait: bool = False):
+        if isinstance(validate, BackgroundValidator):
+            for validated_epoch, validated_metrics in validate.collect(wait):
+                logger.metrics(validated_metrics, validated_epoch)
+                broadcast_event(Policy.validation_finished, validated_epoch, validated_metrics)
+
     if checkpoints is None:
         checkpoints = _DummyCheckpoints()
     if logger is None:
@@ -73,33 +137,63 @@ def train(train_step: Callable, batch_iter: Callable, n_epochs: int = np.inf, lo
     if not hasattr(batch_iter, '__enter__'):
         batch_iter = _build_context_manager(batch_iter)
 
-    epoch = checkpoints.restore()
+    # the mid-epoch checkpoints are only required from the ``checkpoints`` if they are requested
+    partial = checkpoint_steps is not None or checkpoint_seconds is not None
+    if partial:
+        epoch, progress = checkpoints.restore_partial()
+    else:
+        epoch, progress = checkpoints.restore(), None
+    if progress is not None:
+        _set_random_states(progress['random_states'])
     scalars = {name: value for name, value in kwargs.items() if not isinstance(value, Policy)}
     policies = {name: value for name, value in kwargs.items() if isinstance(value, Policy)}
 
     with batch_iter as iterator:
         try:
             while epoch < n_epochs:
+                train_losses, start = [], 0
+                if progress is not None:
+                    train_losses, start = progress['train_losses'], progress['step']
+                    progress = None
+
+                # the interrupted epoch is started again, because the policies' state is not a part of the checkpoint
                 broadcast_event(Policy.epoch_started, epoch)
 
-                train_losses = []
-                for idx, inputs in enumerate(iterator()):
+                last_save = time.monotonic()
+                for idx, inputs in enumerate(_resume_epoch(iterator(), iterator, start), start):
                     broadcast_event(Policy.train_step_started, epoch, idx)
                     train_losses.append(train_step(*inputs, **scalars, **get_policy_values()))
                     broadcast_event(Policy.train_step_finished, epoch, idx, train_losses[-1])
+                    receive_metrics()
+
+                    if (checkpoint_steps is not None and (idx + 1) % checkpoint_steps == 0) or (
+                            checkpoint_seconds is not None and time.monotonic() - last_save >= checkpoint_seconds):
+                        checkpoints.save_partial(epoch, idx + 1, {
+                            'step': idx + 1, 'train_losses': train_losses, 'random_states': _get_random_states(),
+                        })
+                        last_save = time.monotonic()
 
                 logger.train(train_losses, epoch)
                 logger.policies(get_policy_values(), epoch)
                 broadcast_event(Policy.validation_started, epoch, train_losses)
 
                 metrics = None
-                if validate is not None:
+                if isinstance(validate, BackgroundValidator):
+                    validate.submit(epoch)
+                elif validate is not None:
                     metrics = validate()
                     logger.metrics(metrics, epoch)
+                    broadcast_event(Policy.validation_finished, epoch, metrics)
 
                 broadcast_event(Policy.epoch_finished, epoch, train_losses, metrics)
                 checkpoints.save(epoch)
                 epoch += 1
 
+            receive_metrics(wait=True)
+
         except EarlyStopping:
             pass
+
+    # make sure the last checkpoint is written and raise the writer's errors, if any
+    if hasattr(checkpoints, 'wait'):
+        checkpoints.wait()
@@ -1,7 +1,11 @@
+import hashlib
+import os
 import shutil
 import pickle
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, Union, Iterable
+from typing import Dict, Any, Union, Iterable, Callable, Tuple, NamedTuple
 
 import numpy as np
 import torch
@@ -24,8 +28,10 @@ def save_pickle(o, path):
 
 def load_pickle(o, path):
     with open(path, 'rb') as file:
-        state = pickle.load(file)
+        _set_state(o, pickle.load(file))
 
+
+def _set_state(o, state):
     if hasattr(o, '__setstate__'):
         o.__setstate__(state)
     else:
@@ -41,6 +47,109 @@ def load_torch(o, path):
     o.load_state_dict(torch.load(path))
 
 
+def _to_cpu(state):
+    """Recursively copy all the tensors in ``state`` to cpu, so that the training can't modify them."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return type(state)((key, _to_cpu(value)) for key, value in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(map(_to_cpu, state))
+    return state
+
+
+def _write_bytes(data: bytes, path):
+    with open(path, 'wb') as file:
+        file.write(data)
+
+
+def _take_snapshot(o, detach: bool) -> Tuple[Callable, Any]:
+    """Returns the function that writes the state of ``o`` and the state itself."""
+    if isinstance(o, (torch.nn.Module, torch.optim.Optimizer)):
+        state = o.state_dict()
+        return torch.save, _to_cpu(state) if detach else state
+
+    state = o.__getstate__() if hasattr(o, '__getstate__') else o.__dict__
+    # serializing is the simplest way to get a deep copy
+    return _write_bytes, pickle.dumps(state)
+
+
+class _BlobRef(NamedTuple):
+    """A reference to a blob in a `_BlobStore`."""
+    key: str
+
+
+class _BlobStore:
+    """A content-addressed storage: each tensor or byte string is written once, under the hash of its content."""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    @staticmethod
+    def _hash_tensor(tensor: torch.Tensor) -> str:
+        digest = hashlib.sha256(f'{tensor.dtype}{tuple(tensor.shape)}'.encode())
+        digest.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy())
+        return 'tensor-' + digest.hexdigest()
+
+    def _put(self, key: str, write: Callable, value):
+        file = self.path / key
+        if file.exists():
+            return
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        # torch.save rejects the file names starting with a dot
+        temp = file.with_name(f'{key}.tmp')
+        write(value, temp)
+        os.replace(temp, file)
+
+    def dump(self, state):
+        """Write all the tensors and byte strings in ``state`` and replace them with references."""
+        if isinstance(state, torch.Tensor):
+            key = self._hash_tensor(state)
+            self._put(key, torch.save, state)
+            return _BlobRef(key)
+        if isinstance(state, bytes):
+            key = hashlib.sha256(state).hexdigest()
+            self._put(key, _write_bytes, state)
+            return _BlobRef(key)
+        if isinstance(state, dict):
+            return type(state)((key, self.dump(value)) for key, value in state.items())
+        if isinstance(state, (list, tuple)):
+            return type(state)(map(self.dump, state))
+        return state
+
+    def load(self, state):
+        """The inverse of `dump`."""
+        if isinstance(state, _BlobRef):
+            file = self.path / state.key
+            if state.key.startswith('tensor-'):
+                return torch.load(file)
+            with open(file, 'rb') as fd:
+                return fd.read()
+        if isinstance(state, dict):
+            return type(state)((key, self.load(value)) for key, value in state.items())
+        if isinstance(state, (list, tuple)):
+            return type(state)(map(self.load, state))
+        return state
+
+    @staticmethod
+    def get_references(state) -> set:
+        if isinstance(state, _BlobRef):
+            return {state.key}
+        if isinstance(state, dict):
+            state = list(state.values())
+        if isinstance(state, (list, tuple)):
+            return set().union(*map(_BlobStore.get_references, state))
+        return set()
+
+    def collect_garbage(self, used: set):
+        """Remove the blobs that are not in ``used``."""
+        if self.path.exists():
+            for file in self.path.iterdir():
+                if file.name not in used:
+                    file.unlink()
+
+
 class Checkpoints:
     """
     Saves the most recent iteration to ``base_path`` and removes the previous one.
@@ -55,15 +164,45 @@ class Checkpoints:
     frequency: int
         the frequency with which the objects are stored.
         By default only the latest checkpoint is saved.
+    asynchronous: bool
+        whether to write the checkpoints in a background thread. The states of the objects are copied
+        (the tensors - to cpu) before `save` returns, so the training can continue right away.
+    max_pending: int
+        the maximal number of checkpoints waiting to be written. If it is reached, `save` blocks
+        until the oldest one is written. Only used if ``asynchronous`` is True.
+    deduplicate: bool
+        whether to store each tensor and pickled object only once, under the hash of its content.
+        The checkpoints then only contain small manifests referencing the shared blobs,
+        so keeping many checkpoints costs disk space proportional to what actually changed, e.g.
+        a frozen backbone is stored once.
+
+    Notes
+    -----
+    Each checkpoint is written to a temporary folder, which is then atomically renamed,
+    so an interrupted `save` never leaves a partially written checkpoint that `restore` could pick up.
+
+    Use `save_partial` and `restore_partial` to save and resume the training in the middle of an iteration.
     """
 
-    def __init__(self, base_path: PathLike, objects: Union[Iterable, Dict[PathLike, Any]], frequency: int = np.inf):
+    def __init__(self, base_path: PathLike, objects: Union[Iterable, Dict[PathLike, Any]], frequency: int = np.inf,
+                 asynchronous: bool = False, max_pending: int = 1, deduplicate: bool = False):
+        if max_pending <= 0:
+            raise ValueError(f'`max_pending` must be greater than zero, not {max_pending}.')
+
         self.base_path: Path = Path(base_path)
         self._checkpoint_prefix = 'checkpoint_'
+        self._temp_prefix = '.temp_'
+        self._partial_prefix = 'partial_'
+        self._progress_file = '.progress'
         if not isinstance(objects, dict):
             objects = self._generate_unique_names(objects)
         self.objects = objects or {}
         self.frequency = frequency
+        self.asynchronous = asynchronous
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(1) if asynchronous else None
+        self._blobs = _BlobStore(self.base_path / '.blobs') if deduplicate else None
+        self._pending = deque()
 
     @staticmethod
     @composition(dict)
@@ -89,34 +228,125 @@ class Checkpoints:
         if (iteration + 1) % self.frequency != 0:
             shutil.rmtree(self._get_checkpoint_folder(iteration))
 
-    @staticmethod
-    def _dispatch_saver(o):
-        if isinstance(o, (torch.nn.Module, torch.optim.Optimizer)):
-            return save_torch
-        return save_pickle
-
     @staticmethod
     def _dispatch_loader(o):
         if isinstance(o, (torch.nn.Module, torch.optim.Optimizer)):
             return load_torch
         return load_pickle
 
-    def save(self, iteration: int):
-        """Save the states of all tracked objects."""
-        current_folder = self._get_checkpoint_folder(iteration)
-        current_folder.mkdir(parents=True)
-
-        for path, o in self.objects.items():
-            save = self._dispatch_saver(o)
-            save(o, current_folder / path)
+    def _get_partial_folder(self, iteration, step):
+        return self.base_path / f'{self._partial_prefix}{iteration}_{step}'
 
+    def _find_partial(self):
+        """Returns the (iteration, step) pairs of all the partial checkpoints."""
+        for file in self.base_path.iterdir():
+            file = file.name
+            if file.startswith(self._partial_prefix):
+                yield tuple(map(int, file[len(self._partial_prefix):].split('_')))
+
+    def _clear_partial(self, iteration: int, step: int = np.inf):
+        """Remove the partial checkpoints, that precede the ``step`` of ``iteration``."""
+        for partial in self._find_partial():
+            if partial < (iteration, step):
+                shutil.rmtree(self._get_partial_folder(*partial))
+
+    def _write(self, folder: Path, snapshots: Dict[PathLike, Tuple[Callable, Any]], clear: Callable):
+        temp_folder = folder.with_name(self._temp_prefix + folder.name)
+        # a leftover from an interrupted save
+        if temp_folder.exists():
+            shutil.rmtree(temp_folder)
+        temp_folder.mkdir(parents=True)
+
+        for path, (write, state) in snapshots.items():
+            if self._blobs is not None and path != self._progress_file:
+                write, state = _write_bytes, pickle.dumps(self._blobs.dump(state))
+            write(state, temp_folder / path)
+
+        os.rename(temp_folder, folder)
+        clear()
+        if self._blobs is not None:
+            self._collect_garbage()
+
+    def _collect_garbage(self):
+        used = set()
+        for folder in self.base_path.iterdir():
+            if folder.name.startswith((self._checkpoint_prefix, self._partial_prefix)):
+                for path in self.objects:
+                    with open(folder / path, 'rb') as file:
+                        used.update(_BlobStore.get_references(pickle.load(file)))
+
+        self._blobs.collect_garbage(used)
+
+    def _submit(self, folder: Path, snapshots: Dict[PathLike, Tuple[Callable, Any]], clear: Callable):
+        if not self.asynchronous:
+            return self._write(folder, snapshots, clear)
+
+        while len(self._pending) >= self.max_pending:
+            self._pending.popleft().result()
+        self._pending.append(self._executor.submit(self._write, folder, snapshots, clear))
+
+    def _clear_after_save(self, iteration: int):
         if iteration:
             self._clear_checkpoint(iteration - 1)
+        self._clear_partial(iteration)
+
+    def save(self, iteration: int):
+        """Save the states of all tracked objects."""
+        if self._get_checkpoint_folder(iteration).exists():
+            raise FileExistsError(f'The checkpoint "{self._get_checkpoint_folder(iteration)}" already exists.')
+
+        snapshots = {path: _take_snapshot(o, self.asynchronous) for path, o in self.objects.items()}
+        self._submit(self._get_checkpoint_folder(iteration), snapshots, lambda: self._clear_after_save(iteration))
+
+    def save_partial(self, iteration: int, step: int, progress: Any = None):
+        """
+        Save the states of all tracked objects after ``step`` steps of ``iteration``, along with an arbitrary
+        picklable ``progress`` within the iteration. Only the most recent partial checkpoint is kept,
+        and it is removed once the whole ``iteration`` is saved.
+        """
+        snapshots = {path: _take_snapshot(o, self.asynchronous) for path, o in self.objects.items()}
+        snapshots[self._progress_file] = _write_bytes, pickle.dumps(progress)
+        self._submit(self._get_partial_folder(iteration, step), snapshots,
+                     lambda: self._clear_partial(iteration, step))
+
+    def wait(self):
+        """Block until all the pending checkpoints are written. Re-raises the exceptions from the writer, if any."""
+        while self._pending:
+            self._pending.popleft().result()
+
+    def _restore_objects(self, folder: Path):
+        for path, o in self.objects.items():
+            if self._blobs is None:
+                load = self._dispatch_loader(o)
+                load(o, folder / path)
+                continue
+
+            with open(folder / path, 'rb') as file:
+                state = self._blobs.load(pickle.load(file))
+            if isinstance(o, (torch.nn.Module, torch.optim.Optimizer)):
+                o.load_state_dict(state)
+            else:
+                _set_state(o, pickle.loads(state))
 
     def restore(self) -> int:
         """Restore the most recent states of all tracked objects and return next iteration's index."""
+        return self.restore_partial()[0]
+
+    def restore_partial(self) -> Tuple[int, Any]:
+        """
+        Restore the most recent states of all tracked objects, including the ones saved by `save_partial`.
+
+        Returns
+        -------
+        iteration: int
+            the index of the iteration to continue from.
+        progress
+            the progress within ``iteration`` passed to `save_partial`,
+            or None if the most recent checkpoint was saved by `save`.
+        """
+        self.wait()
         if not self.base_path.exists():
-            return 0
+            return 0, None
 
         max_iteration = -1
         for file in self.base_path.iterdir():
@@ -124,18 +354,20 @@ class Checkpoints:
             if file.startswith(self._checkpoint_prefix):
                 max_iteration = max(max_iteration, int(file[len(self._checkpoint_prefix):]))
 
-        # no backups found
-        if max_iteration < 0:
-            return 0
-
         iteration = max_iteration + 1
-        last_folder = self._get_checkpoint_folder(iteration - 1)
+        partial = max((p for p in self._find_partial() if p[0] == iteration), default=None)
+        if partial is not None:
+            folder = self._get_partial_folder(*partial)
+            self._restore_objects(folder)
+            with open(folder / self._progress_file, 'rb') as file:
+                return iteration, pickle.load(file)
 
-        for path, o in self.objects.items():
-            load = self._dispatch_loader(o)
-            load(o, last_folder / path)
+        # no backups found
+        if max_iteration < 0:
+            return 0, None
 
-        return iteration
+        self._restore_objects(self._get_checkpoint_folder(iteration - 1))
+        return iteration, None
 
 
 CheckpointManager = Checkpoints
@@ -1,9 +1,15 @@
+import json
+import os
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta
 from typing import Sequence, Callable, Dict, Any, List
 
 import numpy as np
 
 from dpipe.dataset.base import AbstractAttribute, ABCAttributesMeta
+from dpipe.io import PathLike
+from .logging import Logger
 
 
 class Policy:
@@ -43,6 +49,14 @@ class Policy:
         The history of ``train_losses`` and ``metrics`` from the entire ``epoch`` is provided as additional information.
         """
 
+    def validation_finished(self, epoch: int, metrics: dict):
+        """
+        Update the policy after the ``metrics`` for ``epoch`` were calculated.
+
+        If the validation is performed in background, e.g. by `BackgroundValidator`,
+        this may happen several train steps after the ``epoch`` was finished.
+        """
+
 
 class ValuePolicy(Policy, metaclass=ABCAttributesMeta):
     """
@@ -248,3 +262,135 @@ class TimeProfiler(Policy):
     # this policy is stateless
     def __getstate__(self):
         return {}
+
+
+class PhaseProfiler(Policy):
+    """
+    Measures the duration of each phase of the training loop with `time.perf_counter_ns`:
+
+    - ``batch_wait`` - waiting for the batch iterator, i.e. the data loading stalls;
+    - ``train_step`` - the train step itself;
+    - ``validation`` - the validation after the epoch;
+    - ``checkpoint`` - the time between the end of an epoch and the start of the next one, which is mostly
+      spent on saving the checkpoints. Reported together with the next epoch.
+
+    After each epoch the total, mean and p50/p95/p99 percentiles (in seconds) of each phase are
+    passed to ``logger``, or printed, if ``logger`` is None.
+
+    Parameters
+    ----------
+    logger: Logger, None, optional
+        the logger to export the statistics to, as ``time/<phase>/<statistic>`` values.
+    trace_path: PathLike, None, optional
+        if not None - all the measured phases are written to this file in the Chrome trace (JSON array) format,
+        which can be viewed in ``chrome://tracing`` or https://ui.perfetto.dev.
+        After each epoch only its own events are appended to the file.
+    sync_cuda: bool
+        whether to call ``torch.cuda.synchronize()`` before each measurement, so that the asynchronously
+        launched kernels are attributed to the right phase. Slows down the training a bit.
+    """
+
+    def __init__(self, logger: Logger = None, trace_path: PathLike = None, sync_cuda: bool = False):
+        self.logger = logger
+        self.trace_path = trace_path
+        self.sync_cuda = sync_cuda
+        self.durations: Dict[str, List[int]] = defaultdict(list)
+        self._events = []
+        self._trace_started = False
+        self._origin = time.perf_counter_ns()
+        self._last = self._epoch_end = None
+
+    def _now(self) -> int:
+        if self.sync_cuda:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+        return time.perf_counter_ns()
+
+    def _record(self, phase: str, start: int, stop: int, epoch: int, **args):
+        self.durations[phase].append(stop - start)
+        if self.trace_path is not None:
+            self._events.append({
+                'name': phase, 'ph': 'X', 'pid': 0, 'tid': 0, 'ts': (start - self._origin) / 1000,
+                'dur': (stop - start) / 1000, 'args': {'epoch': epoch, **args},
+            })
+
+    def _mark(self, phase: str, epoch: int, **args):
+        """Record the phase that lasted since the previous mark."""
+        now = self._now()
+        if self._last is not None:
+            self._record(phase, self._last, now, epoch, **args)
+        self._last = now
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns the statistics of the current epoch's phases, in seconds."""
+        stats = {}
+        for phase, durations in self.durations.items():
+            durations = np.array(durations) / 1e9
+            p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+            stats[phase] = dict(total=durations.sum(), mean=durations.mean(), p50=p50, p95=p95, p99=p99)
+        return stats
+
+    def get_histogram(self, phase: str, bins: int = 20):
+        """Returns the histogram of the current epoch's ``phase`` durations in seconds, with log-spaced bins."""
+        durations = np.array(self.durations[phase]) / 1e9
+        if not durations.size:
+            return np.histogram(durations, bins)
+        low, high = np.log10(max(durations.min(), 1e-9)), np.log10(max(durations.max(), 1e-9))
+        return np.histogram(durations, np.logspace(low, high + 1e-6, bins + 1))
+
+    def epoch_started(self, epoch: int):
+        self.durations.clear()
+        now = self._now()
+        if self._epoch_end is not None:
+            self._record('checkpoint', self._epoch_end, now, epoch - 1)
+        self._last = now
+
+    def train_step_started(self, epoch: int, iteration: int):
+        self._mark('batch_wait', epoch, iteration=iteration)
+
+    def train_step_finished(self, epoch: int, iteration: int, loss: Any):
+        self._mark('train_step', epoch, iteration=iteration)
+
+    def validation_started(self, epoch: int, train_losses: Sequence):
+        self._last = self._now()
+
+    def epoch_finished(self, epoch: int, train_losses: Sequence, metrics: dict = None):
+        self._mark('validation', epoch)
+        self._epoch_end = self._last
+
+        stats = self.get_stats()
+        if self.logger is None:
+            print(f'Epoch {epoch} time profiling (seconds):', flush=True)
+            for phase, values in stats.items():
+                print('  ', f'{phase}:', ', '.join(f'{name}={value:.4f}' for name, value in values.items()), flush=True)
+            print(flush=True)
+        else:
+            for phase, values in stats.items():
+                for name, value in values.items():
+                    self.logger.value(f'time/{phase}/{name}', value, epoch)
+
+        if self.trace_path is not None:
+            self._write_trace()
+
+    def _write_trace(self):
+        """Append the current events to the trace, keeping it a valid JSON array."""
+        if not self._events:
+            return
+
+        events = ',\n'.join(map(json.dumps, self._events)).encode()
+        if not self._trace_started:
+            with open(self.trace_path, 'wb') as file:
+                file.write(b'[\n' + events + b'\n]')
+            self._trace_started = True
+        else:
+            with open(self.trace_path, 'rb+') as file:
+                # overwrite the closing bracket
+                file.seek(-2, os.SEEK_END)
+                file.write(b',\n' + events + b'\n]')
+
+        self._events.clear()
+
+    # this policy is stateless
+    def __getstate__(self):
+        return {}
@@ -1,7 +1,9 @@
 import tempfile
 import unittest
+from pathlib import Path
 
 import numpy as np
+import torch
 
 from dpipe.train.checkpoint import Checkpoints
 from dpipe.train.policy import Exponential, DecreasingOnPlateau, Schedule
@@ -58,3 +60,75 @@ class TestCheckpoints(unittest.TestCase):
 
                 manager.restore()
                 assert params == self.get_params(policies)
+
+    def test_asynchronous(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            policies = [
+                Exponential(1, .1, 10, False),
+                DecreasingOnPlateau(initial=1, multiplier=.1, patience=4, rtol=.02, atol=.02),
+            ]
+            manager = Checkpoints(tempdir, policies, frequency=3, asynchronous=True, max_pending=2)
+
+            history = []
+            for epoch in range(10):
+                self.advance_policies(policies, 4)
+                manager.save(epoch)
+                history.append(self.get_params(policies))
+
+            self.advance_policies(policies, 4)
+            assert manager.restore() == 10
+            assert history[-1] == self.get_params(policies)
+
+            names = sorted(path.name for path in Path(tempdir).iterdir())
+            assert names == ['checkpoint_2', 'checkpoint_5', 'checkpoint_8', 'checkpoint_9']
+
+    def test_interrupted(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            policy = DecreasingOnPlateau(initial=1, multiplier=.1, patience=4, rtol=.02, atol=.02)
+            manager = Checkpoints(tempdir, [policy])
+            manager.save(0)
+            value = policy.value
+
+            # a partially written checkpoint
+            (Path(tempdir) / '.temp_checkpoint_1').mkdir()
+            self.advance_policies([policy], 4)
+            assert manager.restore() == 1
+            assert policy.value == value
+
+            manager.save(1)
+            assert sorted(path.name for path in Path(tempdir).iterdir()) == ['checkpoint_1']
+
+    def test_deduplicate(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            frozen, trained = torch.nn.Linear(10, 10), torch.nn.Linear(10, 1)
+            policy = DecreasingOnPlateau(initial=1, multiplier=.1, patience=4, rtol=.02, atol=.02)
+            manager = Checkpoints(tempdir, [frozen, trained, policy], frequency=1, deduplicate=True)
+            blobs = Path(tempdir) / '.blobs'
+
+            for epoch in range(5):
+                with torch.no_grad():
+                    trained.weight += 1
+                manager.save(epoch)
+
+            # 2 frozen tensors, 1 bias, 5 weights, 1 policy state
+            assert len(list(blobs.iterdir())) == 9
+            weight = trained.weight.clone()
+
+            with torch.no_grad():
+                trained.weight += 1
+                frozen.weight += 1
+            self.advance_policies([policy], 4)
+            assert manager.restore() == 5
+            torch.testing.assert_close(trained.weight, weight)
+
+    def test_deduplicate_garbage(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            model = torch.nn.Linear(10, 1)
+            manager = Checkpoints(tempdir, [model], deduplicate=True)
+            for epoch in range(5):
+                with torch.no_grad():
+                    model.weight += 1
+                manager.save(epoch)
+
+            # only the blobs referenced by the last checkpoint are left
+            assert len(list((Path(tempdir) / '.blobs').iterdir())) == 2
@@ -0,0 +1,184 @@
+import time
+
+import numpy as np
+import pytest
+import torch
+
+from dpipe.io import load_json
+from dpipe.train import (
+    train, Checkpoints, Logger, Policy, PhaseProfiler, BackgroundValidator, LambdaEpoch, TimeProfiler,
+)
+
+
+class Interrupted(Exception):
+    pass
+
+
+class ListLogger(Logger):
+    def __init__(self):
+        self.losses = {}
+
+    def train(self, train_losses, step):
+        self.losses[step] = list(train_losses)
+
+    def value(self, name, value, step):
+        pass
+
+
+class Recorder(Policy):
+    def __init__(self, interrupt=None):
+        self.interrupt = interrupt
+        self.steps = []
+
+    def train_step_started(self, epoch: int, iteration: int):
+        if (epoch, iteration) == self.interrupt:
+            raise Interrupted
+        self.steps.append((epoch, iteration))
+
+
+def test_resume_mid_epoch(tmpdir):
+    batches = [(i,) for i in range(10)]
+
+    def train_step(x):
+        return x + np.random.uniform()
+
+    recorder = Recorder(interrupt=(1, 7))
+    with pytest.raises(Interrupted):
+        train(train_step, lambda: iter(batches), n_epochs=2, checkpoints=Checkpoints(tmpdir, []),
+              checkpoint_steps=3, recorder=recorder)
+    assert recorder.steps[-1] == (1, 6)
+
+    recorder, logger = Recorder(), ListLogger()
+    train(train_step, lambda: iter(batches), n_epochs=2, checkpoints=Checkpoints(tmpdir, []), logger=logger,
+          checkpoint_steps=3, recorder=recorder)
+    # only the remaining steps are performed after the restart
+    assert recorder.steps == [(1, i) for i in range(6, 10)]
+    assert len(logger.losses[1]) == 10
+    assert sorted(path.basename for path in tmpdir.listdir()) == ['checkpoint_1']
+
+
+def test_resume_policies(tmpdir):
+    def train_step(x, lr):
+        lrs.append((x, lr))
+
+    lrs = []
+    with pytest.raises(Interrupted):
+        train(train_step, lambda: [(i,) for i in range(4)], n_epochs=2, checkpoints=Checkpoints(tmpdir, []),
+              checkpoint_steps=1, lr=LambdaEpoch(lambda epoch: 10. ** -epoch), recorder=Recorder(interrupt=(1, 2)))
+    assert lrs[-1] == (1, .1)
+
+    lrs = []
+    train(train_step, lambda: [(i,) for i in range(4)], n_epochs=2, checkpoints=Checkpoints(tmpdir, []),
+          checkpoint_steps=1, lr=LambdaEpoch(lambda epoch: 10. ** -epoch), profiler=TimeProfiler())
+    # the epoch-based policies are restored for the interrupted epoch
+    assert lrs == [(2, .1), (3, .1)]
+
+
+def test_save_partial(tmpdir):
+    checkpoints = Checkpoints(tmpdir, [])
+    assert checkpoints.restore_partial() == (0, None)
+
+    checkpoints.save(0)
+    checkpoints.save_partial(1, 5, 'five')
+    checkpoints.save_partial(1, 10, 'ten')
+    assert checkpoints.restore_partial() == (1, 'ten')
+    assert checkpoints.restore() == 1
+
+    checkpoints.save(1)
+    assert checkpoints.restore_partial() == (2, None)
+    assert sorted(path.basename for path in tmpdir.listdir()) == ['checkpoint_1']
+
+
+def test_phase_profiler(tmpdir):
+    class ValuesLogger(ListLogger):
+        def __init__(self):
+            super().__init__()
+            self.values = {}
+
+        def value(self, name, value, step):
+            self.values[name, step] = value
+
+    def batch_iter():
+        for i in range(5):
+            time.sleep(.01)
+            yield i,
+
+    logger = ValuesLogger()
+    profiler = PhaseProfiler(logger, trace_path=tmpdir / 'trace.json')
+    train(lambda x: x, batch_iter, n_epochs=3, validate=lambda: time.sleep(.02) or {}, profiler=profiler)
+
+    for epoch in range(3):
+        assert logger.values['time/batch_wait/p50', epoch] >= .01
+        assert logger.values['time/validation/total', epoch] >= .02
+        assert logger.values['time/train_step/p99', epoch] < .01
+    assert ('time/checkpoint/mean', 1) in logger.values
+    assert len(profiler.get_histogram('batch_wait')[0]) == 20
+
+    events = load_json(tmpdir / 'trace.json')
+    assert {event['name'] for event in events} == {'batch_wait', 'train_step', 'validation', 'checkpoint'}
+    assert sum(event['name'] == 'train_step' for event in events) == 15
+    # the events are written after each epoch and aren't kept in memory
+    assert not profiler._events
+
+
+def test_background_validator():
+    class Model:
+        value = 0
+
+    class MetricsRecorder(Policy):
+        def __init__(self):
+            self.metrics = []
+
+        def validation_finished(self, epoch, metrics):
+            self.metrics.append((epoch, metrics))
+
+    class MetricsLogger(ListLogger):
+        def __init__(self):
+            super().__init__()
+            self.received = {}
+
+        def metrics(self, metrics, step):
+            self.received[step] = metrics
+
+    def train_step(x):
+        model.value += 1
+        time.sleep(.001)
+        return x
+
+    def validate(snapshot):
+        time.sleep(.05)
+        return {'value': snapshot.value}
+
+    model, recorder, logger = Model(), MetricsRecorder(), MetricsLogger()
+    train(train_step, lambda: [(i,) for i in range(10)], n_epochs=4, logger=logger,
+          validate=BackgroundValidator(validate, model), recorder=recorder)
+
+    # the metrics are calculated on the weights at the end of each epoch
+    expected = [(epoch, {'value': 10 * (epoch + 1)}) for epoch in range(4)]
+    assert recorder.metrics == expected
+    assert logger.received == dict(expected)
+
+
+def test_custom_checkpoints():
+    class EpochCheckpoints:
+        def __init__(self):
+            self.saved = []
+
+        def save(self, iteration):
+            self.saved.append(iteration)
+
+        def restore(self):
+            return 2
+
+    checkpoints, recorder = EpochCheckpoints(), Recorder()
+    train(lambda x: x, lambda: [(i,) for i in range(3)], n_epochs=4, checkpoints=checkpoints, recorder=recorder)
+    assert checkpoints.saved == [2, 3]
+    assert recorder.steps == [(epoch, i) for epoch in [2, 3] for i in range(3)]
+
+
+def test_asynchronous_checkpoints(tmpdir):
+    checkpoints = Checkpoints(tmpdir, {'model.pth': torch.nn.Linear(100, 100)}, asynchronous=True)
+    train(lambda x: x, lambda: [(i,) for i in range(3)], n_epochs=2, checkpoints=checkpoints)
+    # the last checkpoint is written before `train` returns
+    assert not checkpoints._pending
+    assert (tmpdir / 'checkpoint_1' / 'model.pth').exists()
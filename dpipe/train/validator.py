@@ -1,4 +1,7 @@
-from typing import Sequence, Callable, Iterable
+import copy
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Sequence, Callable, Iterable, List, Tuple
 
 
 def evaluate(y_true: Sequence, y_pred: Sequence, metrics: dict) -> dict:
@@ -48,3 +51,69 @@ def evaluate_predict(predict: Callable, xs: Iterable, ys_true: Sequence, metrics
 
 def compute_metrics(predict: Callable, load_x: Callable, load_y: Callable, ids: Sequence[str], metrics: dict):
     return evaluate(list(map(load_y, ids)), [predict(load_x(i)) for i in ids], metrics)
+
+
+class BackgroundValidator:
+    """
+    Runs the validation in a background thread, so that the training continues while the metrics are calculated.
+    Pass it as the ``validate`` argument to `train`: the metrics are passed to the logger and to
+    `Policy.validation_finished` once they are ready.
+
+    Parameters
+    ----------
+    validate: Callable
+        a function that calculates the metrics on the validation set. If ``model`` is not None, it receives
+        a frozen copy of ``model``, otherwise it is called without arguments.
+    model: torch.nn.Module, None, optional
+        the model to copy before each validation, so that the train steps don't affect the metrics.
+        Note that the copy is located on the same device as the model.
+    max_pending: int
+        the maximal number of validations running or waiting in the queue. If it is reached,
+        the training blocks until the oldest validation is finished.
+
+    Notes
+    -----
+    The validation and the train steps share the GIL, which is released during the most of torch's
+    computations, so the overlap is significant for GPU inference.
+
+    Examples
+    --------
+    >>> def validate(model):
+    >>>     return compute_metrics(partial(predict, model=model), load_x, load_y, val_ids, metrics)
+    >>>
+    >>> train(train_step, batch_iter, n_epochs, logger, validate=BackgroundValidator(validate, model))
+    """
+
+    def __init__(self, validate: Callable, model=None, max_pending: int = 1):
+        if max_pending <= 0:
+            raise ValueError(f'`max_pending` must be greater than zero, not {max_pending}.')
+
+        self.validate = validate
+        self.model = model
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(1)
+        self._pending = deque()
+
+    def submit(self, epoch: int):
+        """Start the validation after ``epoch``."""
+        # the finished validations stay in the queue until they are collected
+        unfinished = [future for _, future in self._pending if not future.done()]
+        for future in unfinished[:len(unfinished) - self.max_pending + 1]:
+            future.result()
+
+        if self.model is None:
+            future = self._executor.submit(self.validate)
+        else:
+            future = self._executor.submit(self.validate, copy.deepcopy(self.model))
+        self._pending.append((epoch, future))
+
+    def collect(self, wait: bool = False) -> List[Tuple[int, dict]]:
+        """
+        Returns the (epoch, metrics) pairs of the finished validations in the order they were submitted.
+        If ``wait`` is True - blocks until all the pending validations are finished.
+        """
+        results = []
+        while self._pending and (wait or self._pending[0][1].done()):
+            epoch, future = self._pending.popleft()
+            results.append((epoch, future.result()))
+        return results